@@ -5,38 +5,53 @@ Django template preprocessor.
 Author: Jonathan Slenders, City Live
 """
 from template_preprocessor.core.django_processor import parse
-from template_preprocessor.core.context import Context
+from template_preprocessor.core.context import Context, CompileSession
 
 
 def output_tree(tree):
     return tree.output_as_string()
 
 
+def is_static_output(output):
+    """
+    True when this compiled template does not contain any Django tags,
+    variables or comments anymore. (Rendering it always returns the same
+    string.)
+    """
+    from django.template.base import Lexer, TOKEN_TEXT
+    return all(t.token_type == TOKEN_TEXT for t in Lexer(output, None).tokenize())
+
+
 def _default_loader(path):
     return open(path).read()
 
 
-def compile(code, path='', loader=None, options=None, context_class=None):
+def compile(code, path='', loader=None, options=None, context_class=None, session=None):
     """
     Compile the template, do everything, and return a single document
     as a string. The loader should look like: (lambda path: return code)
     and is called for the includes/extends.
+    Pass the same CompileSession to every call when compiling several
+    templates in one run.
     """
-    tree, context = compile_to_parse_tree(code, path, loader, options, context_class)
+    tree, context = compile_to_parse_tree(code, path, loader, options, context_class, session)
 
     #print tree._print()
     #print output_tree(tree)
 
-    return output_tree(tree), context
+    output = output_tree(tree)
+    context.is_static = is_static_output(output)
+
+    return output, context
 
 
-def compile_to_parse_tree(code, path='', loader=None, options=None, context_class=None):
+def compile_to_parse_tree(code, path='', loader=None, options=None, context_class=None, session=None):
     # Make the loader also parse the templates
     def new_loader(include_path):
         return parse( (loader or _default_loader)(include_path), include_path, context)
 
     # Create preprocess context
-    context = (context_class or Context)(path, new_loader, options)
+    context = (context_class or Context)(path, new_loader, options, session=session)
 
     # Parse template, and return output
     return parse(code, path, context, main_template=True), context
@@ -5,6 +5,7 @@ Django template preprocessor.
 Author: Jonathan Slenders, City Live
 """
 from template_preprocessor.core.lexer import CompileException
+from copy import copy
 import os
 
 from template_preprocessor.core.utils import compile_external_javascript_files, compile_external_css_files
@@ -27,10 +28,13 @@ class Context(object):
     Preprocess context. Contains the compile settings, error logging,
     remembers dependencies, etc...
     """
-    def __init__(self, path, loader=None, extra_options=None, insert_debug_symbols=False):
+    def __init__(self, path, loader=None, extra_options=None, insert_debug_symbols=False, session=None):
         self.loader = loader
         self.insert_debug_symbols = insert_debug_symbols
 
+        # State shared with the other templates compiled in this run.
+        self.session = session or CompileSession()
+
         # Remember stuff
         self.warnings = []
         self.media_dependencies = []
@@ -44,10 +48,12 @@ class Context(object):
         self.include_dependencies = []
         self.extends_dependencies = []
 
+        # Set after compiling: True when the output contains no Django tags
+        # or variables at all.
+        self.is_static = False
+
         # Process options
-        self.options = Options()
-        for o in extra_options or []:
-            self.options.change(o)
+        self.options = Options.for_options(extra_options)
 
     def compile_media_callback(self, compress_tag, media_files):
         """
@@ -97,6 +103,194 @@ class Context(object):
 
 
 
+class CompileSession(object):
+    """
+    State which is shared between all the templates that are compiled in one
+    run. (All the templates of a compile_templates call, or all the templates
+    compiled by one template loader.) Everything in here is computed only once.
+    """
+    def __init__(self, variables=None):
+        self._extra_variables = dict(variables or { })
+        self._variables = None
+        self._urls = { } # (language, urlconf, name, args, kwargs) -> url or NoReverseMatch
+        self._catalogs = { } # language -> translation object
+        self._translations = { } # (language, domain, string(s)) -> translated string
+        self._preprocessed_tags = { } # (language, tagname, args) -> output or NotPreprocessable
+
+    def register_variable(self, name, value):
+        """
+        Register a preprocessable variable: every {{ name }} will be replaced
+        by this value. `value` can also be a callable, which is called once.
+        """
+        self._extra_variables[name] = value
+        self._variables = None
+
+    @property
+    def preprocessable_variables(self):
+        """
+        Dictionary of the variables which are known at compile time.
+        """
+        if self._variables is None:
+            self._variables = self._get_preprocessable_variables()
+        return self._variables
+
+    def _get_preprocessable_variables(self):
+        from django.conf import settings
+
+        variables = {
+            'MEDIA_URL': getattr(settings, 'MEDIA_URL', ''),
+            'STATIC_URL': getattr(settings, 'STATIC_URL', ''),
+        }
+
+        if 'django.contrib.sites' in settings.INSTALLED_APPS:
+            from django.contrib.sites.models import Site
+            try:
+                # Don't preprocess anything when we don't have a Site
+                # instance yet.
+                site = Site.objects.get_current()
+                variables.update({
+                    'SITE_DOMAIN': site.domain,
+                    'SITE_NAME': site.name,
+                    'SITE_URL': 'http://%s' % site.domain,
+                })
+            except Site.DoesNotExist, e:
+                pass
+
+        # User defined constants.
+        #   -- settings.py --
+        #   TEMPLATE_PREPROCESSOR_CONSTANTS = { 'SUPPORT_EMAIL': 'support@example.com' }
+        variables.update(getattr(settings, 'TEMPLATE_PREPROCESSOR_CONSTANTS', { }))
+        variables.update(self._extra_variables)
+
+        for name, value in variables.items():
+            if callable(value):
+                variables[name] = value()
+
+        return variables
+
+    def reverse(self, name, args=None, kwargs=None):
+        """
+        Memoized django.core.urlresolvers.reverse. Raises NoReverseMatch
+        (also memoized) when the URL can not be reversed.
+        """
+        # Do 'reverse' import at this point. To be sure we use the
+        # latest version. Other Django plug-ins like localeurl tend
+        # to monkey patch this code. (And make the result depend on the
+        # active language.)
+        from django.conf import settings
+        from django.core.urlresolvers import reverse, get_urlconf, NoReverseMatch
+        from django.utils import translation
+
+        args = args or []
+        kwargs = kwargs or { }
+        key = (translation.get_language(), get_urlconf() or settings.ROOT_URLCONF,
+                    name, tuple(args), tuple(sorted(kwargs.items())))
+
+        if key not in self._urls:
+            try:
+                self._urls[key] = reverse(name, args=args, kwargs=kwargs)
+            except NoReverseMatch, e:
+                self._urls[key] = e
+
+        result = self._urls[key]
+        if isinstance(result, NoReverseMatch):
+            raise result
+        return result
+
+    def _get_catalog(self, language):
+        """
+        Translation object for this language, loaded once per session.
+        None when USE_I18N is disabled.
+        """
+        if language not in self._catalogs:
+            from django.conf import settings
+            if settings.USE_I18N:
+                from django.utils.translation import trans_real
+                self._catalogs[language] = trans_real.translation(language)
+            else:
+                self._catalogs[language] = None
+        return self._catalogs[language]
+
+    def ugettext(self, string):
+        """
+        Memoized ugettext for the active language.
+        """
+        from django.utils import translation
+
+        language = translation.get_language()
+        key = (language, 'django', string)
+
+        if key not in self._translations:
+            catalog = self._get_catalog(language)
+            if catalog is None:
+                self._translations[key] = translation.ugettext(string)
+            else:
+                # Same newline normalisation as Django's do_translate.
+                self._translations[key] = catalog.ugettext(string.replace('\r\n', '\n').replace('\r', '\n'))
+
+        return self._translations[key]
+
+    def ungettext(self, singular, plural, number):
+        """
+        Memoized ungettext for the active language.
+        """
+        from django.utils import translation
+
+        language = translation.get_language()
+        key = (language, 'django', singular, plural, number)
+
+        if key not in self._translations:
+            catalog = self._get_catalog(language)
+            if catalog is None:
+                self._translations[key] = translation.ungettext(singular, plural, number)
+            else:
+                self._translations[key] = catalog.ungettext(singular, plural, number)
+
+        return self._translations[key]
+
+    def execute_preprocessable_tag(self, tagname, args):
+        """
+        Output of this preprocessable template tag, or raise NotPreprocessable.
+        The output of cacheable tags is memoized.
+        """
+        from django.utils import translation
+        from template_preprocessor.core.preprocessable_template_tags import \
+                    get_preprocessable_tags, is_cacheable_tag, NotPreprocessable
+
+        func = get_preprocessable_tags()[tagname]
+        if not is_cacheable_tag(tagname):
+            return func(*args)
+
+        key = (translation.get_language(), tagname, tuple(args))
+
+        if key not in self._preprocessed_tags:
+            try:
+                self._preprocessed_tags[key] = func(*args)
+            except NotPreprocessable, e:
+                self._preprocessed_tags[key] = e
+
+        result = self._preprocessed_tags[key]
+        if isinstance(result, NotPreprocessable):
+            raise result
+        return result
+
+    def translate_js(self, string):
+        """
+        Memoized translation of gettext(...) calls in javascript, using the
+        djangojs catalog of the active language.
+        """
+        from django.utils import translation
+        from template_preprocessor.core.js_processor import translate_js
+
+        key = (translation.get_language(), 'djangojs', string)
+
+        if key not in self._translations:
+            self._translations[key] = translate_js(string)
+
+        return self._translations[key]
+
+
+
 class PreprocessWarning(Warning):
     def __init__(self, node, message):
         self.node = node
@@ -137,35 +331,58 @@ class Options(object):
         self.disallow_orphan_blocks = False # An error will be raised when a block has been defined, which is not present in the parent.
         self.disallow_block_level_elements_in_inline_level_elements = False
 
+    # Option name -> (attribute, value)
+    _ACTIONS = {
+        'compile-css': ('compile_css', True),
+        'compile-javascript': ('compile_javascript', True),
+        'disallow-orphan-blocks': ('disallow_orphan_blocks', True),
+        'html': ('is_html', True), # Enable HTML extensions
+        'html-remove-empty-class-attributes': ('remove_empty_class_attributes', True),
+        'merge-internal-css': ('merge_internal_css', True),
+        'merge-internal-javascript': ('merge_internal_javascript', True),
+        'no-disallow-orphan-blocks': ('disallow_orphan_blocks', False),
+        'no-html': ('is_html', False), # Disable all HTML specific options
+        'no-i18n-preprocessing': ('preprocess_translations', False),
+        'no-if-preprocessing': ('preprocess_ifdebug', False),
+        'no-macro-preprocessing': ('preprocess_macros', False),
+        'no-pack-external-css': ('pack_external_css', False),
+        'no-pack-external-javascript': ('pack_external_javascript', False),
+        'no-remove-empty-tags': ('remove_some_tags', False),
+        'no-validate-html': ('validate_html', False),
+        'no-whitespace-compression': ('whitespace_compression', False),
+        'pack-external-css': ('pack_external_css', True),
+        'pack-external-javascript': ('pack_external_javascript', True),
+        'validate-html': ('validate_html', True),
+        'whitespace-compression': ('whitespace_compression', True),
+        'no-block-level-elements-in-inline-level-elements': ('disallow_block_level_elements_in_inline_level_elements', True),
+    }
+
+    # Tuple of option names -> Options instance
+    _cache = { }
+
+    @classmethod
+    def for_options(cls, options):
+        """
+        Return a new Options instance, with these options applied.
+        (The result for every combination of options is only computed once.)
+        """
+        key = tuple(options or [])
+
+        if key not in cls._cache:
+            result = cls()
+            for o in key:
+                result.change(o)
+            cls._cache[key] = result
+
+        # Return a copy, {% ! ... %} tags in the template can still change the options.
+        return copy(cls._cache[key])
+
     def change(self, value, node=None):
         """
         Change an option. Called when the template contains a {% ! ... %} option tag.
         """
-        actions = {
-            'compile-css': ('compile_css', True),
-            'compile-javascript': ('compile_javascript', True),
-            'disallow-orphan-blocks': ('disallow_orphan_blocks', True),
-            'html': ('is_html', True), # Enable HTML extensions
-            'html-remove-empty-class-attributes': ('remove_empty_class_attributes', True),
-            'merge-internal-css': ('merge_internal_css', True),
-            'merge-internal-javascript': ('merge_internal_javascript', True),
-            'no-disallow-orphan-blocks': ('disallow_orphan_blocks', False),
-            'no-html': ('is_html', False), # Disable all HTML specific options
-            'no-i18n-preprocessing': ('preprocess_translations', False),
-            'no-macro-preprocessing': ('preprocess_macros', False),
-            'no-pack-external-css': ('pack_external_css', False),
-            'no-pack-external-javascript': ('pack_external_javascript', False),
-            'no-validate-html': ('validate_html', False),
-            'no-whitespace-compression': ('whitespace_compression', False),
-            'pack-external-css': ('pack_external_css', True),
-            'pack-external-javascript': ('pack_external_javascript', True),
-            'validate-html': ('validate_html', True),
-            'whitespace-compression': ('whitespace_compression', True),
-            'no-block-level-elements-in-inline-level-elements': ('disallow_block_level_elements_in_inline_level_elements', True),
-        }
-
-        if value in actions:
-            setattr(self, actions[value][0], actions[value][1])
+        if value in self._ACTIONS:
+            setattr(self, self._ACTIONS[value][0], self._ACTIONS[value][1])
         else:
             if node:
                 raise CompileException(node, 'No such template preprocessor option: %s' % value)
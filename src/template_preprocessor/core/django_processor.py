@@ -13,8 +13,8 @@ This parser will call the html/css/js parser if required.
 """
 
 from django.conf import settings
-from django.template import TemplateDoesNotExist
-from django.utils.translation import ugettext as _, ungettext
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, Variable
+from django.template.smartif import IfParser, Literal
 
 from template_preprocessor.core.lexer import Token, State, StartToken, Shift, StopToken, Push, Pop, Error, Record, CompileException
 from template_preprocessor.core.preprocessable_template_tags import get_preprocessable_tags, NotPreprocessable
@@ -861,9 +861,54 @@ def _preprocess_decorate_tags(tree, context):
             raise CompileException(decorate_block, 'Template in {% decorate %} tag not found (%s)' % decorate_block.template_name)
 
 
+_FILTER_RE = re.compile(r'\|\s*(\w+)')
+
+def _get_used_tags_and_filters(tree):
+    """
+    Return the names of the template tags and filters which are used in the
+    output of this tree.
+    """
+    from django.template.base import Lexer, TOKEN_BLOCK, TOKEN_VAR
+
+    tags = set()
+    filters = set()
+
+    for token in Lexer(tree.output_as_string(), None).tokenize():
+        if token.token_type == TOKEN_BLOCK:
+            bits = token.contents.split()
+            if bits:
+                tags.add(bits[0])
+            filters.update(_FILTER_RE.findall(token.contents))
+
+            # {% filter name|name2:arg %}
+            if len(bits) > 1 and bits[0] == 'filter':
+                filters.update(f.split(':')[0] for f in bits[1].split('|'))
+
+        elif token.token_type == TOKEN_VAR:
+            filters.update(_FILTER_RE.findall(token.contents))
+
+    return tags, filters
+
+
+def _is_library_used(module, tags, filters):
+    """
+    True when one of the tags or filters of this template tag library is used.
+    (Or when we can't tell.)
+    """
+    from django.template.base import get_library, InvalidTemplateLibrary
+
+    try:
+        library = get_library(module)
+    except InvalidTemplateLibrary, e:
+        return True
+
+    return any(t in tags for t in library.tags) or any(f in filters for f in library.filters)
+
+
 def _group_all_loads(tree):
     """
     Look for all {% load %} tags, and group them to one, on top.
+    Libraries of which no tag or filter is used anymore are left out.
     """
     all_modules = set()
     first_load_tag = None
@@ -885,9 +930,13 @@ def _group_all_loads(tree):
     # Remove all {% load %} nodes except {% load ... from future %}
     tree.remove_child_nodes(to_remove)
 
+    # Drop the unused libraries
+    tags, filters = _get_used_tags_and_filters(tree)
+    all_modules = [ m for m in all_modules if _is_library_used(m, tags, filters) ]
+
     # Place all {% load %} in the first node of the tree
-    if first_load_tag:
-        first_load_tag.modules = list(all_modules)
+    if first_load_tag and all_modules:
+        first_load_tag.modules = sorted(all_modules)
         tree.children.insert(0, first_load_tag)
 
         # But {% extends %} really needs to be placed before everything else
@@ -898,15 +947,11 @@ def _group_all_loads(tree):
         for e in extends_tags:
             tree.children.insert(0, e)
 
-def _preprocess_urls(tree):
+def _preprocess_urls(tree, context):
     """
     Replace URLs without variables by their resolved value.
     """
-    # Do 'reverse' import at this point. To be sure we use the
-    # latest version. Other Django plug-ins like localeurl tend
-    # to monkey patch this code.
     from django.core.urlresolvers import NoReverseMatch
-    from django.core.urlresolvers import reverse
 
     def parse_url_params(urltag):
         if not urltag.url_params:
@@ -930,7 +975,7 @@ def _preprocess_urls(tree):
         try:
             name, args, kwargs = parse_url_params(urltag)
             if not 'as' in args:
-                result = reverse(name, args=args, kwargs=kwargs)
+                result = context.session.reverse(name, args=args, kwargs=kwargs)
                 urltag.preprocess(result)
         except NoReverseMatch, e:
             pass
@@ -947,7 +992,7 @@ def _preprocess_variables(tree, values_dict):
         if var.varname in values_dict:
             value = values_dict[var.varname]
             var.__class__ = DjangoPreprocessedVariable
-            var.init([value])
+            var.init([ value if isinstance(value, basestring) else unicode(value) ])
 
                 # TODO: escape
                 #       -> for now we don't escape because
@@ -955,7 +1000,92 @@ def _preprocess_variables(tree, values_dict):
                 #          and 'resolve' is only be used for variables
                 #          like MEDIA_URL which are safe in HTML.
 
-def _preprocess_trans_tags(tree):
+class _NotConstant(Exception):
+    pass
+
+
+def _resolve_constant(token, constants):
+    """
+    Value of this {% if %} parameter, when it's a literal or one of the known
+    constants. Raise _NotConstant otherwise.
+    """
+    if '|' in token:
+        raise _NotConstant
+
+    try:
+        var = Variable(token)
+    except TemplateSyntaxError, e:
+        raise _NotConstant
+
+    if var.translate:
+        raise _NotConstant
+    elif var.literal is not None:
+        return var.literal
+    elif token in constants:
+        return constants[token]
+    else:
+        raise _NotConstant
+
+
+class _ConstantIfParser(IfParser):
+    """
+    Django's {% if %} expression parser, but only accepting literals and
+    known constants as operands.
+    """
+    def __init__(self, tokens, constants):
+        self.constants = constants
+        IfParser.__init__(self, tokens)
+
+    def create_var(self, value):
+        return Literal(_resolve_constant(value, self.constants))
+
+
+def _preprocess_if_tags(tree, constants):
+    """
+    Replace {% if %} and {% ifequal %} tags of which the condition only
+    depends on literals and known constants (like {{ MEDIA_URL }} or the
+    TEMPLATE_PREPROCESSOR_CONSTANTS) by the branch which will be rendered.
+    """
+    def evaluate(node):
+        # Return True or False for the condition, or raise _NotConstant
+        params = [ p.output_as_string() for p in node._params[1:] ]
+
+        if isinstance(node, DjangoIfEqualTag):
+            # Leave invalid tags to Django, which reports the syntax error.
+            if len(params) != 2:
+                raise _NotConstant
+            return _resolve_constant(params[0], constants) == _resolve_constant(params[1], constants)
+        else:
+            # {% elif %} would have been placed in the first branch.
+            if any(isinstance(c, DjangoTag) and c.tagname == 'elif' for c in node.children):
+                raise _NotConstant
+
+            try:
+                return bool(_ConstantIfParser(params, constants).parse().eval(None))
+            except TemplateSyntaxError, e:
+                raise _NotConstant
+
+    for children in tree.children_lists:
+        new_nodes = []
+        for c in children:
+            if isinstance(c, Token):
+                _preprocess_if_tags(c, constants)
+
+            if isinstance(c, (DjangoIfTag, DjangoIfEqualTag)):
+                try:
+                    if evaluate(c):
+                        new_nodes += c.children
+                    else:
+                        new_nodes += getattr(c, 'children2', [])
+                except _NotConstant, e:
+                    new_nodes.append(c)
+            else:
+                new_nodes.append(c)
+
+        children.__init__(new_nodes)
+
+
+def _preprocess_trans_tags(tree, context):
     """
     Replace {% trans %} and {% blocktrans %} if they don't depend on variables.
     """
@@ -983,9 +1113,9 @@ def _preprocess_trans_tags(tree):
             translation_info = trans.translation_info
 
             # Translate strings
-            string = _(translation_info.string or ' ') # or ' ', because we don't want to translate the empty string which returns PO meta info.
+            string = context.session.ugettext(translation_info.string or ' ') # or ' ', because we don't want to translate the empty string which returns PO meta info.
             if translation_info.has_plural:
-                plural_string = ungettext(translation_info.string, translation_info.plural_string, 2)
+                plural_string = context.session.ungettext(translation_info.string, translation_info.plural_string, 2)
 
             # Replace %(variable)s in translated strings by {{ variable }}
             for v in translation_info.variables:
@@ -1025,7 +1155,7 @@ def _preprocess_trans_tags(tree):
         # Process {% trans "..." %}
         elif isinstance(trans, DjangoTransTag):
             if not trans.is_variable:
-                output = _(trans.string or ' ')
+                output = context.session.ugettext(trans.string or ' ')
                 translation_info = trans.translation_info
                 trans.__class__ = DjangoTranslated
                 trans.init(output, translation_info)
@@ -1050,20 +1180,103 @@ def _preprocess_macros(tree):
     tree.remove_child_nodes_of_class(DjangoMacroTag)
 
 
-def _execute_preprocessable_tags(tree):
+def _execute_preprocessable_tags(tree, context):
     preprocessable_tags = get_preprocessable_tags()
 
     for c in tree.all_children:
         if isinstance(c, DjangoTag) and c.tagname in preprocessable_tags:
             params = [ p.output_as_string() for p in c.get_childnodes_with_name('django-tag-element') ]
             try:
-                c.children = [ preprocessable_tags[c.tagname](*params) ]
+                c.children = [ context.session.execute_preprocessable_tag(c.tagname, params) ]
                 c.__class__ = DjangoContent
             except NotPreprocessable:
                 pass
 
         elif isinstance(c, DjangoContainer):
-            _execute_preprocessable_tags(c)
+            _execute_preprocessable_tags(c, context)
+
+    _preprocess_spaceless_tags(tree)
+
+
+def _preprocess_spaceless_tags(tree):
+    """
+    Apply {% spaceless %} ... {% endspaceless %} at compile time, when
+    there are no other Django tags or variables in between.
+    """
+    from django.utils.html import strip_spaces_between_tags
+
+    for children in tree.children_lists:
+        start = None
+        for c in children[:]:
+            if isinstance(c, DjangoTag) and c.tagname == 'spaceless':
+                start = c
+
+            elif start and isinstance(c, DjangoTag) and c.tagname == 'endspaceless':
+                begin = children.index(start)
+                end = children.index(c)
+                content = u''.join(n if isinstance(n, basestring) else n.output_as_string()
+                                        for n in children[begin+1:end])
+
+                if not any(s in content for s in ('{%', '{{', '{#')):
+                    children[begin:end+1] = [ strip_spaces_between_tags(content.strip()) ]
+                start = None
+
+
+# Tags which don't render anything when there's nothing between them and
+# their end tag.
+_NO_OUTPUT_WHEN_EMPTY = ('autoescape', 'filter', 'spaceless', 'with')
+
+def _remove_empty_tags(tree):
+    """
+    Remove tags which render nothing at runtime, like {% if x %}{% endif %}
+    or {% with a as b %}{% endwith %}, and merge the adjacent text, so that
+    Django's nodelist gets less nodes.
+    """
+    def is_empty(node):
+        if isinstance(node, basestring):
+            return not node
+        else:
+            return not node.output_as_string()
+
+    def is_empty_block_end(nodes, end_tag):
+        # Remove the opening tag from nodes when the end_tag closes it
+        # without anything in between.
+        if not (isinstance(end_tag, DjangoTag) and end_tag.tagname and
+                    end_tag.tagname.startswith('end') and end_tag.tagname[3:] in _NO_OUTPUT_WHEN_EMPTY):
+            return False
+
+        i = len(nodes) - 1
+        while i >= 0 and is_empty(nodes[i]):
+            i -= 1
+
+        if i >= 0 and isinstance(nodes[i], DjangoTag) and nodes[i].tagname == end_tag.tagname[3:]:
+            del nodes[i:]
+            return True
+        return False
+
+    for children in tree.children_lists:
+        new_nodes = []
+        for c in children:
+            if isinstance(c, Token):
+                _remove_empty_tags(c)
+
+            if isinstance(c, basestring):
+                # Merge adjacent text
+                if new_nodes and isinstance(new_nodes[-1], basestring):
+                    new_nodes[-1] += c
+                elif c:
+                    new_nodes.append(c)
+
+            elif isinstance(c, (DjangoIfTag, DjangoIfEqualTag)) and all(all(map(is_empty, l)) for l in c.children_lists):
+                pass
+
+            elif is_empty_block_end(new_nodes, c):
+                pass
+
+            else:
+                new_nodes.append(c)
+
+        children.__init__(new_nodes)
 
 
 def remember_gettext_entries(tree, context):
@@ -1137,35 +1350,19 @@ def parse(source_code, path, context, main_template=False):
 
         # Do translations
         if options.preprocess_translations:
-            _preprocess_trans_tags(tree)
+            _preprocess_trans_tags(tree, context)
 
         # Reverse URLS
         if options.preprocess_urls:
-            _preprocess_urls(tree)
+            _preprocess_urls(tree, context)
 
         # Do variable lookups
         if options.preprocess_variables:
-            sites_enabled = 'django.contrib.sites' in settings.INSTALLED_APPS
-
-            _preprocess_variables(tree,
-                        {
-                            'MEDIA_URL': getattr(settings, 'MEDIA_URL', ''),
-                            'STATIC_URL': getattr(settings, 'STATIC_URL', ''),
-                        })
-            if sites_enabled:
-                from django.contrib.sites.models import Site
-                try:
-                    # Don't preprocess anything when we don't have a Site
-                    # instance yet.
-                    site = Site.objects.get_current()
-                    _preprocess_variables(tree,
-                            {
-                                'SITE_DOMAIN': site.domain,
-                                'SITE_NAME': site.name,
-                                'SITE_URL': 'http://%s' % site.domain,
-                            })
-                except Site.DoesNotExist, e:
-                    pass
+            _preprocess_variables(tree, context.session.preprocessable_variables)
+
+        # Only keep the branch of {% if %} tags which will be rendered.
+        if options.preprocess_ifdebug:
+            _preprocess_if_tags(tree, context.session.preprocessable_variables)
 
         # Don't output {% block %} tags in the compiled file.
         if options.remove_block_tags:
@@ -1175,15 +1372,19 @@ def parse(source_code, path, context, main_template=False):
         if options.preprocess_macros:
             _preprocess_macros(tree)
 
+        # Preprocessable tags
+        if options.execute_preprocessable_tags:
+            _execute_preprocessable_tags(tree, context)
+
         # Group all {% load %} statements
         if options.merge_all_load_tags:
             _group_all_loads(tree)
 
-        # Preprocessable tags
-        if options.execute_preprocessable_tags:
-            _execute_preprocessable_tags(tree)
-
         # HTML compiler
         if options.is_html:
             compile_html(tree, context)
+
+        # Remove tags which render nothing
+        if options.remove_some_tags:
+            _remove_empty_tags(tree)
     return tree
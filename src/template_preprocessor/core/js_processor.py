@@ -779,7 +779,7 @@ def _process_gettext(js_node, context, validate_only=False):
 
                         if not validate_only:
                             # Translate content
-                            translation = translate_js(body)
+                            translation = context.session.translate_js(body)
 
                             # Replace gettext(...) call by its translation (in double quotes.)
                             gettext.__class__ = JavascriptDoubleQuotedString
@@ -32,8 +32,9 @@ class NotPreprocessable(Exception):
 # === Discover preprocessable tags
 
 __preprocessabel_tags = { }
+__cacheable_tags = set()
 
-def preprocess_tag(func_or_name):
+def preprocess_tag(func_or_name=None, cacheable=False):
     """
     > @preprocess_tag
     > def my_template_tag(*args):
@@ -42,15 +43,36 @@ def preprocess_tag(func_or_name):
     > @preprocess_tag('my_template_tag')
     > def func(*args):
     >     return '<p>.....</p>'
+
+    Tags of which the output only depends on the arguments (and the active
+    language) can be registered as cacheable. They are called only once for
+    every combination of arguments during a compile run.
+
+    > @preprocess_tag('my_template_tag', cacheable=True)
+    > def func(*args):
+    >     return '<p>.....</p>'
     """
-    if isinstance(func_or_name, basestring):
+    def register(name, func):
+        __preprocessabel_tags[name] = func
+        if cacheable:
+            __cacheable_tags.add(name)
+        else:
+            __cacheable_tags.discard(name)
+        return func
+
+    if func_or_name is None or isinstance(func_or_name, basestring):
         def decorator(func):
-            __preprocessabel_tags[func_or_name] = func
-            return func
+            return register(func_or_name or func.__name__, func)
         return decorator
     else:
-        __preprocessabel_tags[func_or_name.__name__] = func_or_name
-        return func_or_name
+        return register(func_or_name.__name__, func_or_name)
+
+
+def is_cacheable_tag(name):
+    """
+    True when this preprocessable tag has been registered as cacheable.
+    """
+    return name in __cacheable_tags
 
 
 def discover_template_tags():
@@ -78,7 +100,7 @@ def get_preprocessable_tags():
 # ==== Build-in preprocessable tags ====
 
 
-@preprocess_tag('google_analytics')
+@preprocess_tag('google_analytics', cacheable=True)
 def _google_analytics(*args):
     if len(args) != 1: raise NotPreprocessable()
 
@@ -109,3 +131,57 @@ def _now(*args):
     else:
         raise NotPreprocessable()
 
+
+
+def _literal(arg):
+    """
+    Value of a literal template tag argument, like "string" or 123.
+    Raise NotPreprocessable for variables.
+    """
+    from django.template import Variable, TemplateSyntaxError
+
+    if '|' in arg:
+        raise NotPreprocessable()
+    try:
+        var = Variable(arg)
+    except TemplateSyntaxError, e:
+        raise NotPreprocessable()
+
+    if var.literal is None or var.translate:
+        raise NotPreprocessable()
+    return var.literal
+
+
+@preprocess_tag('static', cacheable=True)
+def _static(*args):
+    """
+    {% static "path" %} (from the static and staticfiles template tag
+    libraries), as long as the storage does not alter the file names.
+    """
+    if len(args) != 2:
+        raise NotPreprocessable()
+
+    if 'django.contrib.staticfiles' in settings.INSTALLED_APPS and \
+                getattr(settings, 'STATICFILES_STORAGE', 'django.contrib.staticfiles.storage.StaticFilesStorage') != \
+                'django.contrib.staticfiles.storage.StaticFilesStorage':
+        raise NotPreprocessable()
+
+    path = _literal(args[1])
+    if not isinstance(path, basestring):
+        raise NotPreprocessable()
+
+    from django.templatetags.static import static
+    return static(path)
+
+
+@preprocess_tag('firstof', cacheable=True)
+def _firstof(*args):
+    """
+    {% firstof "a" "b" %}, when the arguments up to the first one which is
+    not empty are literals.
+    """
+    for arg in args[1:]:
+        value = _literal(arg)
+        if value:
+            return unicode(value)
+    return u''
@@ -9,15 +9,16 @@ import termcolor
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.core.urlresolvers import reverse
-from django.template import TemplateDoesNotExist
+from django.template import TemplateDoesNotExist, TemplateSyntaxError, StringOrigin
+from django.template.loader import get_template_from_string
 
 from template_preprocessor.core import compile
 from template_preprocessor.core.lexer import CompileException
 
 from template_preprocessor.utils import language, template_iterator, load_template_source, get_template_path
-from template_preprocessor.utils import get_options_for_path, execute_precompile_command
+from template_preprocessor.utils import get_options_for_path, execute_precompile_command, save_pickled_template
 from template_preprocessor.core.utils import need_to_be_recompiled, create_media_output_path
-from template_preprocessor.core.context import Context
+from template_preprocessor.core.context import Context, CompileSession
 
 
 class Command(BaseCommand):
@@ -30,7 +31,9 @@ class Command(BaseCommand):
         make_option('--noinput', action='store_false', dest='interactive', default=True,
                         help='Tell Django to NOT prompt the user for input of any kind.'),
         make_option('--insert-debug-symbols', action='store_true', dest='insert_debug_symbols', default=False,
-                        help='Insert debug symbols in template output')
+                        help='Insert debug symbols in template output'),
+        make_option('--pickle', action='store_true', dest='pickle_templates', default=False,
+                        help='Also store the parsed Django Template objects (used by the PreprocessedLoader)'),
     )
 
 
@@ -110,6 +113,10 @@ class Command(BaseCommand):
         single_template = options['single_template']
         interactive = options['interactive']
         self.insert_debug_symbols = options['insert_debug_symbols']
+        self.pickle_templates = options['pickle_templates']
+
+        # Shared between all compiled templates
+        self.session = CompileSession()
 
         # Default verbosity
         self.verbosity = int(options.get('verbosity', 1))
@@ -124,6 +131,7 @@ class Command(BaseCommand):
 
 
         self._errors = []
+        self._unpickled_templates = []
         if languages.sort() != options['languages'].sort():
             print self.colored('Warning: all template languages are deleted while we won\'t generate them again.',
                                     'white', 'on_red')
@@ -156,7 +164,7 @@ class Command(BaseCommand):
         queue = self._build_compile_queue(options['languages'], all_templates, single_template)
 
         # Precompile command
-        execute_precompile_command()
+        execute_precompile_command(wait=True)
 
         # Compile queue
         for i in range(0, len(queue)):
@@ -172,6 +180,9 @@ class Command(BaseCommand):
         # Show all errors once again.
         print u'\n*** %i Files processed, %i compile errors ***' % (len(queue), len(self._errors))
 
+        if self._unpickled_templates:
+            print u'*** %i Templates could not be pickled, these are parsed at runtime ***' % len(self._unpickled_templates)
+
         # Build media compile queue
         media_queue = self._build_compile_media_queue(options['languages'])
 
@@ -335,11 +346,11 @@ class Command(BaseCommand):
             if no_html:
                 output, context = compile(code, path=input_path, loader=load_template_source,
                             options=get_options_for_path(input_path) + ['no-html'],
-                            context_class=self.NiceContext)
+                            context_class=self.NiceContext, session=self.session)
             else:
                 output, context = compile(code, path=input_path, loader=load_template_source,
                             options=get_options_for_path(input_path),
-                            context_class=self.NiceContext)
+                            context_class=self.NiceContext, session=self.session)
 
             # store dependencies
             self._save_template_dependencies(lang, template, context.template_dependencies)
@@ -349,6 +360,20 @@ class Command(BaseCommand):
             # Open output file
             codecs.open(output_path, 'w', 'utf-8').write(output)
 
+            # Mark templates without any Django tags or variables.
+            if context.is_static:
+                open(output_path + '-c-static', 'w').close()
+
+            elif os.path.exists(output_path + '-c-static'):
+                os.remove(output_path + '-c-static')
+
+            # Pickle Django Template object
+            if self.pickle_templates:
+                self._pickle_template(template, output, output_path)
+
+            elif os.path.exists(output_path + '-c-pickled'):
+                os.remove(output_path + '-c-pickled')
+
             # Delete -c-recompile file (mark for recompilation) if one such exist.
             if os.path.exists(output_path + '-c-recompile'):
                 os.remove(output_path + '-c-recompile')
@@ -374,6 +399,21 @@ class Command(BaseCommand):
             if self.verbosity >= 2:
                 print u'WARNING: Template does not exist:  %s' % unicode(e)
 
+    def _pickle_template(self, template, output, output_path):
+        """
+        Parse the compiled output with Django's template parser, and store the
+        pickled Template object next to the output.
+        """
+        try:
+            django_template = get_template_from_string(output, StringOrigin(output), template)
+        except TemplateSyntaxError, e:
+            self.print_error(u'ERROR:  Django could not parse compiled template %s: %s' % (template, unicode(e)))
+            return
+
+        if not save_pickled_template(output_path + '-c-pickled', django_template):
+            self._unpickled_templates.append(template)
+            print u'WARNING: Template could not be pickled:  %s' % template
+
     def _create_dir(self, newdir):
         if not os.path.isdir(newdir):
             os.makedirs(newdir)
@@ -12,8 +12,9 @@ from django.core.urlresolvers import reverse
 from django.template import TemplateDoesNotExist
 
 from template_preprocessor.core import compile_to_parse_tree
-from template_preprocessor.render_engine.render import compile_tree
+from template_preprocessor.render_engine.render import compile_tree, save_code_object
 from template_preprocessor.core.lexer import CompileException
+from template_preprocessor.core.context import CompileSession
 
 from template_preprocessor.utils import language, template_iterator, load_template_source
 
@@ -49,6 +50,7 @@ class Command(BaseCommand):
             options['languages'] = languages
 
         self._errors = []
+        self.session = CompileSession()
 
         cache_dir = os.path.join(settings.TEMPLATE_CACHE_DIR, 'compiled_to_code')
 
@@ -77,6 +79,7 @@ class Command(BaseCommand):
                 if (
                         all_templates or
                         not os.path.exists(output_path) or
+                        not os.path.exists(output_path + '-c-code') or
                         os.path.getmtime(output_path) < os.path.getmtime(input_path)):
                     queue.add( (lang, input_path, output_path) )
 
@@ -102,13 +105,17 @@ class Command(BaseCommand):
             code = codecs.open(input_path, 'r', 'utf-8').read()
 
             # Compile
-            output = compile_to_parse_tree(code, loader=load_template_source, path=input_path)
+            output, context = compile_to_parse_tree(code, loader=load_template_source, path=input_path, session=self.session)
             output2 = compile_tree(output)
 
             # Open output file
             self._create_dir(os.path.split(output_path)[0])
             codecs.open(output_path, 'w', 'utf-8').write(output2)
 
+            # Store the code object, so that the template loader doesn't
+            # have to compile anything.
+            save_code_object(output_path + '-c-code', output2, input_path)
+
         except CompileException, e:
             self.print_error(u'ERROR:  %s' % unicode(e))
 
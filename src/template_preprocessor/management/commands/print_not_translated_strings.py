@@ -12,6 +12,7 @@ from django.template import TemplateDoesNotExist
 
 from template_preprocessor.core import compile_to_parse_tree
 from template_preprocessor.core.lexer import CompileException
+from template_preprocessor.core.context import CompileSession
 
 from template_preprocessor.utils import template_iterator, load_template_source
 from template_preprocessor.utils import get_options_for_path
@@ -47,6 +48,7 @@ class Command(BaseCommand):
         self.boring = bool(options.get('boring'))
 
         self._errors = []
+        self.session = CompileSession()
 
         # Build compile queue
         queue = self._build_compile_queue(single_template)
@@ -108,7 +110,7 @@ class Command(BaseCommand):
 
             # Compile
             tree, context = compile_to_parse_tree(code, path=input_path, loader=load_template_source,
-                        options=options)
+                        options=options, session=self.session)
 
             # Now find all nodes, which contain text, but not in trans blocks.
             from template_preprocessor.core.html_processor import HtmlContent, HtmlStyleNode, HtmlScriptNode
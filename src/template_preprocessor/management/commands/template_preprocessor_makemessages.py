@@ -14,6 +14,7 @@ from django.template import TemplateDoesNotExist
 
 from template_preprocessor.core import compile
 from template_preprocessor.core.lexer import CompileException
+from template_preprocessor.core.context import CompileSession
 
 from template_preprocessor.utils import language, template_iterator, load_template_source, get_template_path
 from template_preprocessor.utils import get_options_for_path
@@ -29,6 +30,7 @@ class Command(BaseCommand):
         self.verbosity = int(options.get('verbosity', 1))
 
         self.strings = { } # Maps msgid -> list of paths
+        self.session = CompileSession()
 
         # Build queue
         queue = set()
@@ -73,7 +75,7 @@ class Command(BaseCommand):
 
             # Compile
             output, context = compile(code, path=input_path, loader=load_template_source,
-                        options=get_options_for_path(input_path))
+                        options=get_options_for_path(input_path), session=self.session)
 
             for entry in context.gettext_entries:
                 line = '#: %s:%s:%s' % (entry.path, entry.line, entry.column)
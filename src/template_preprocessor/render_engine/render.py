@@ -42,14 +42,21 @@
 #    -> UPDATE: it's difficult to replace stdout. it would cause difficult template
 #    tag implementations, when using tags like {% filter escape %}i[Madi, it would cause
 #    several levels of wrapped-stdouts. -> now using a custom _write function.
+#    -> UPDATE 2: the generated code is a generator function which yields the
+#    output. This way, Template.render_iter can stream the output, and nested
+#    captures (like {% filter %}) are just a u''.join of a nested generator.
 
 
 # Very interesting documentation:
 # http://docs.python.org/reference/executionmodel.html
 
 
-from template_preprocessor.core.django_processor import DjangoTag, DjangoContent, DjangoVariable, DjangoPreprocessorConfigTag, DjangoTransTag, DjangoBlocktransTag, DjangoComment, DjangoMultilineComment, DjangoUrlTag, DjangoLoadTag, DjangoCompressTag, DjangoRawOutput
+from template_preprocessor.core.django_processor import DjangoTag, DjangoContent, DjangoVariable, DjangoPreprocessorConfigTag, DjangoTransTag, DjangoBlocktransTag, DjangoComment, DjangoMultilineComment, DjangoUrlTag, DjangoLoadTag, DjangoCompressTag, DjangoRawOutput, DjangoIfTag, DjangoIfEqualTag, DjangoBlockTag, DjangoIncludeTag, DjangoPreprocessedInclude, DjangoPreprocessedCallMacro
 from template_preprocessor.core.html_processor import HtmlNode
+from django.utils.html import strip_spaces_between_tags
+from django.utils.encoding import force_unicode
+from django.utils.safestring import mark_safe, SafeData, SafeString, SafeUnicode
+from django.utils.text import unescape_string_literal
 from django.utils.translation import ugettext as _
 
 from template_preprocessor.core.lexer import Token, State, StartToken, Shift, StopToken, Push, Pop, Error, Record, CompileException
@@ -57,6 +64,11 @@ from template_preprocessor.core.lexer_engine import tokenize
 
 from template_preprocessor.core.lexer import CompileException
 
+from hashlib import sha1
+import imp
+import marshal
+import os
+import re
 import sys
 
 def _escape_python_string(string):
@@ -91,6 +103,16 @@ _DJANGO_VARIABLE_STATES = {
 }
 
 
+def _parse_variable(name):
+    """
+    Parse tree of this template variable (with filters).
+    """
+    tree = Token(name='root', line=1, column=1, path='django variable')
+    tree.children = [ name ]
+    tokenize(tree, _DJANGO_VARIABLE_STATES, [Token])
+    return tree
+
+
 
 # ==================================[ Code generator ]===================================
 
@@ -105,9 +127,42 @@ class CodeGenerator(object):
         self._tmp_print_code = [] # Needed to group print consecutive statements
         self._indent_level = 0
 
+        # Push/pop stack, for each function: True when it yields something.
+        self._yields = [ False ]
+
+        # Functions are written at the module level. The code of the
+        # enclosing functions is saved in here.
+        self._functions = [] # Code of every function
+        self._function_stack = [] # (code, indent_level) of the enclosing functions
+        self._function_counter = 0
+
         # Push/pop stack of variable scopes.
         self._scopes = [ set() ]
 
+        # Push/pop stack of aliases, for each scope: template variable ->
+        # Python expression. (Like forloop.counter -> (_i1 + 1))
+        self._aliases = [ { } ]
+        self._name_counter = 0
+
+        # Lookups of context paths in the current function. When the same
+        # path is used again, the lookup is done only once and assigned to a
+        # local variable. (See `lookup`.)
+        self._lookups = [] # (indent level, path, lookup id) which can be reused
+        self._lookups_stack = [] # Lookups of the enclosing functions
+        self._lookup_paths = { } # lookup id -> path
+
+        # Module level code, executed once when the template is loaded.
+        # (Filters and constants which are bound at compile time.)
+        self._constants = []
+        self._constant_names = { } # Python expression -> name of the constant
+        self._filter_names = { } # (library, filter name) -> name of the constant
+
+        # Template tag libraries from {% load %} tags.
+        self._libraries = []
+
+        # Changed by {% autoescape %}
+        self._autoescape = [ True ]
+
         self._tag = None
 
     def tag_proxy(self, tag):
@@ -131,17 +186,32 @@ class CodeGenerator(object):
     def write(self, line, _flush=True):
         if _flush:
             self._flush_print_cache()
+        if line.startswith('yield ') or line.startswith('for _o in '):
+            self._yields[-1] = True
         self._code.append('\t'*self._indent_level + line)
 
     def _flush_print_cache(self):
         if self._tmp_print_code:
-            self.write('_w(u"""%s""")' % _escape_python_string(''.join(self._tmp_print_code)), False)
+            self.write('yield u"""%s"""' % _escape_python_string(''.join(self._tmp_print_code)), False)
             self._tmp_print_code = []
 
     def write_print(self, text):
         if text:
             self._tmp_print_code.append(text)
 
+    def write_output(self, code):
+        """
+        Output the result of this Python expression.
+        """
+        self.write('yield %s' % code)
+
+    def write_output_of(self, code):
+        """
+        Output everything yielded by this Python expression. (Call of a
+        function written with `function`.)
+        """
+        self.write('for _o in %s: yield _o' % code)
+
     def indent(self):
         """
         Indent source code written in here. (Nested in current indentation level.)
@@ -151,12 +221,80 @@ class CodeGenerator(object):
             def __enter__(s):
                 self._flush_print_cache()
                 self._indent_level += 1
+                s.length = len(self._code)
 
             def __exit__(s, type, value, traceback):
                 self._flush_print_cache()
+                # Empty blocks are not valid Python
+                if len(self._code) == s.length:
+                    self.write('pass')
                 self._indent_level -= 1
+
+                # Lookups done in this block are not available after it
+                self._lookups = [ l for l in self._lookups if l[0] <= self._indent_level ]
         return Indenter()
 
+    def function(self, params='', name=None):
+        """
+        Write a generator function, which yields the output of the code
+        written in here. The function is hoisted to the module level, so
+        that it's only created once. It receives the context and the variables
+        of the enclosing scopes as additional parameters.
+        Usage:
+            with generator.function('a, b') as f:
+                ...
+            generator.write_output_of(f.call('1, 2'))
+        """
+        generator = self
+        own_params = [ p.strip() for p in params.split(',') if p.strip() ]
+
+        class Function(object):
+            def __init__(s):
+                if name:
+                    s.name = name
+                    s.closure = []
+                else:
+                    generator._function_counter += 1
+                    s.name = '_b%i' % generator._function_counter
+                    s.closure = [ '_c' ] + sorted(set(v for scope in generator._scopes for v in scope
+                                        if v not in own_params))
+
+            @property
+            def args(s):
+                """ The additional parameters, which have to be passed to this function """
+                return ', '.join(s.closure)
+
+            def call(s, args=''):
+                return '%s(%s)' % (s.name, ', '.join(a for a in (args, s.args) if a))
+
+            def __enter__(s):
+                # Write in a new buffer, at the module level
+                generator._flush_print_cache()
+                generator._function_stack.append((generator._code, generator._indent_level))
+                generator._code = []
+                generator._indent_level = 0
+                generator._lookups_stack.append(generator._lookups)
+                generator._lookups = []
+
+                generator.write('def %s(%s):' % (s.name, ', '.join(own_params + s.closure)))
+                s.indenter = generator.indent()
+                s.indenter.__enter__()
+                generator._yields.append(False)
+                return s
+
+            def __exit__(s, type, value, traceback):
+                generator._flush_print_cache()
+                # A function without yield is not a generator
+                if not generator._yields.pop():
+                    generator.write('return iter(())')
+                s.indenter.__exit__(type, value, traceback)
+
+                generator._functions.append('\n'.join(generator._assign_lookups(generator._code)))
+                generator._code, generator._indent_level = generator._function_stack.pop()
+                generator._lookups = generator._lookups_stack.pop()
+
+        return Function()
+
     def write_indented(self, lines):
         with self.indent():
             for l in lines:
@@ -169,6 +307,82 @@ class CodeGenerator(object):
         else:
             self._scopes[-1].add(var)
 
+            # Lookups in a variable with the same name can't be reused anymore
+            self._lookups = [ l for l in self._lookups if not re.match(r'%s\b' % var, l[1]) ]
+
+    def lookup(self, path):
+        """
+        Return an expression for this lookup path. (Like '_c.user.name'.)
+        When the same path is used again further on in the same block, or in a
+        nested block of the current function, both will use a local variable
+        which is assigned only once. (The expression returned here is a
+        placeholder, replaced by `_assign_lookups`.)
+        """
+        for level, p, id in self._lookups:
+            if p == path:
+                break
+        else:
+            id = len(self._lookup_paths) + 1
+            self._lookup_paths[id] = path
+            self._lookups.append((self._indent_level, path, id))
+
+        return '\x00%i\x00' % id
+
+    def keep_none(self, code):
+        """
+        Like this expression, but when it's a lookup in the context, None
+        values are returned as they are, instead of as an empty string.
+        """
+        match = self._lookup_re.match(code)
+        if match and match.group(0) == code:
+            path = self._lookup_paths[int(match.group(1))]
+            if path.endswith('")') and '._resolve("' in path:
+                return self.lookup('%s, None)' % path[:-1])
+        return code
+
+    def invalidate_lookups(self):
+        """
+        Don't reuse the lookups done until now. Call this when the code
+        written after this point could have changed the context. (Like when
+        calling a function.)
+        """
+        self._lookups = []
+
+    _lookup_re = re.compile('\x00([0-9]+)\x00')
+
+    def _assign_lookups(self, lines):
+        """
+        Replace the lookup placeholders in the code of this function. A
+        path which is looked up more than once is assigned to a local
+        variable, right before the line where it's used for the first time.
+        """
+        # Printed text (the template source) is never a placeholder.
+        is_code = lambda line: not line.lstrip('\t').startswith('yield u"""')
+
+        uses = { }
+        for line in lines:
+            if is_code(line):
+                for id in self._lookup_re.findall(line):
+                    uses[id] = uses.get(id, 0) + 1
+
+        result = []
+        assigned = set()
+
+        for line in lines:
+            if is_code(line):
+                for id in self._lookup_re.findall(line):
+                    if uses[id] > 1 and id not in assigned:
+                        indent = line[:len(line) - len(line.lstrip('\t'))]
+                        result.append('%s_l%s = %s' % (indent, id, self._lookup_paths[int(id)]))
+                        assigned.add(id)
+
+                line = self._lookup_re.sub(lambda m:
+                            ('_l%s' % m.group(1)) if uses[m.group(1)] > 1 else self._lookup_paths[int(m.group(1))],
+                            line)
+            result.append(line)
+
+        return result
+
 
     def scope(self):
         """
@@ -178,11 +392,77 @@ class CodeGenerator(object):
         class ScopeCreater(object):
             def __enter__(s):
                 self._scopes.append(set())
+                self._aliases.append({ })
 
             def __exit__(s, type, value, traceback):
                 self._scopes.pop()
+                self._aliases.pop()
         return ScopeCreater()
 
+    def push_context(self, enabled=True):
+        """
+        Push a new dictionary on the Django context for the code written in
+        here, and pop it afterwards. (Variables assigned by tags which are
+        rendered through Django are not visible after the block, like in
+        Django's {% for %} and {% with %}.)
+        Usage: with generator.push_context():
+        """
+        class ContextPusher(object):
+            def __enter__(s):
+                if enabled:
+                    self.write('_c._context.push()')
+                    self.write('try:')
+                    s.indenter = self.indent()
+                    s.indenter.__enter__()
+
+            def __exit__(s, type, value, traceback):
+                if enabled:
+                    s.indenter.__exit__(type, value, traceback)
+                    self.write('finally:')
+                    with self.indent():
+                        self.write('_c._context.pop()')
+        return ContextPusher()
+
+    def autoescaping(self, enabled):
+        """
+        Enable or disable autoescaping for the code generated in here.
+        Usage: with generator.autoescaping(False):
+        """
+        class Autoescaping(object):
+            def __enter__(s):
+                self._autoescape.append(enabled)
+
+            def __exit__(s, type, value, traceback):
+                self._autoescape.pop()
+        return Autoescaping()
+
+    def register_alias(self, name, expression):
+        """
+        In the current scope, compile this template variable to the given
+        Python expression. (A number or boolean, its output is never escaped.)
+        """
+        self._aliases[-1][name] = expression
+
+    def get_alias(self, name):
+        for aliases in reversed(self._aliases):
+            if name in aliases:
+                return aliases[name]
+
+    def template_variables(self):
+        """
+        Python code for a dictionary of all the template variables which are
+        defined at this point. (For passing them to Django's template engine.)
+        """
+        names = sorted(set(v for scope in self._scopes for v in scope if not v.startswith('_')))
+        return '{ %s }' % ', '.join('"%s": %s' % (v, v) for v in names)
+
+    def unique_name(self, prefix):
+        """
+        Return a new name for a local Python variable.
+        """
+        self._name_counter += 1
+        return '%s%i' % (prefix, self._name_counter)
+
     def variable_in_current_scope(self, variable):
         """
         True when this variable name has been defined in the current or one of the
@@ -198,18 +478,14 @@ class CodeGenerator(object):
         # a.1.b -> a[1].b
         # 8.a   -> CompileException
         # "..." -> "..."
-        # var|filter:"..."|filter2:value  -> _filters['filter2'](_filters['filter'](var))
-
-        # Parse the variable
-        tree = Token(name='root', line=1, column=1, path='django variable')
-        tree.children = [ name ]
-        tokenize(tree, _DJANGO_VARIABLE_STATES, [Token])
+        # var|filter:"..."|filter2:value  -> _f2(_f1(var, _k1), value)
 
-        #print tree._print()
+        tree = _parse_variable(name)
 
         def handle_filter(subject, children):
             filter_name = None
             filter_option = None
+            filter_option_type = None
             in_filter_option = False
 
             def result():
@@ -218,11 +494,15 @@ class CodeGenerator(object):
                 if filter_name in _native_filters:
                     return _native_filters[filter_name](self, subject, filter_option)
 
-                elif filter_option:
-                    return '_f["%s"](%s, %s)' % (filter_name, subject, filter_option)
+                elif filter_option_type == 'string':
+                    # String literals are marked safe, like in Django.
+                    return self.call_filter(filter_name, subject, self.constant('_safe(u%s)' % filter_option))
+
+                elif filter_option_type == 'name':
+                    return self.call_filter(filter_name, subject, self.convert_variable(filter_option))
 
                 else:
-                    return '_f["%s"](%s)' % (filter_name, subject)
+                    return self.call_filter(filter_name, subject, filter_option)
 
             for i in range(0,len(children)):
                 part = children[i].output_as_string()
@@ -231,12 +511,14 @@ class CodeGenerator(object):
                 if c.name == 'digits':
                     if not filter_option and in_filter_option:
                         filter_option = part
+                        filter_option_type = c.name
                     else:
                         raise CompileException(self._tag, 'Invalid variable')
 
                 elif c.name == 'name':
                     if not filter_option and in_filter_option:
                         filter_option = part
+                        filter_option_type = c.name
 
                     elif not filter_name:
                         filter_name = part
@@ -246,12 +528,14 @@ class CodeGenerator(object):
                 elif c.name == 'string':
                     if not filter_option and in_filter_option:
                         filter_option = part
+                        filter_option_type = c.name
                     else:
                         raise CompileException(self._tag, 'Invalid variable')
 
                 elif c.name == 'trans':
                     if not filter_option and in_filter_option:
                         filter_option = '_(%s)' % c.output_as_string()
+                        filter_option_type = c.name
                     else:
                         raise CompileException(self._tag, 'Invalid variable')
 
@@ -267,12 +551,35 @@ class CodeGenerator(object):
 
         def handle_var(children):
             out = []
+            is_path = True # False when this is not a lookup in the context or a variable
+            last_name = [ None ] # (position in out, prefix, name) of the last lookup in the context
+
+            def path(parts):
+                # Variables which compile to another expression
+                alias = self.get_alias(''.join(p.output_as_string() for p in parts))
+                if alias:
+                    return alias
+
+                # The last attribute is looked up through ContextProxy._resolve,
+                # which does not wrap primitive values.
+                if last_name[0] and last_name[0][0] == len(out) - 1:
+                    position, prefix, name = last_name[0]
+                    out[position] = '%s._resolve("%s")' % (prefix, name)
+
+                result = ''.join(out)
+                if is_path and out and (result.startswith('_c') or len(out) > 1):
+                    return self.lookup(result)
+                else:
+                    return result
+
             for i in range(0,len(children)):
                 part = children[i].output_as_string()
                 c = children[i]
 
                 if c.name == 'digits':
                     # First digits are literals, following digits are indexers
+                    if not out:
+                        is_path = False
                     out.append('[%s]' % part if out else part)
 
                 elif c.name == 'dot':
@@ -280,15 +587,22 @@ class CodeGenerator(object):
                     pass
 
                 elif c.name == 'string':
-                    out.append(part)
+                    # String literals are marked safe, like in Django.
+                    # (Also the arguments of native filters, like |default:"&nbsp;")
+                    is_path = False
+                    out.append(self.constant('_safe(u%s)' % part))
 
                 elif c.name == 'name':
                     if out:
+                        # Template variables (like forloop) are no ContextProxy
+                        if out[0].startswith('_c.'):
+                            last_name[0] = (len(out), '', part)
                         out.append('.%s' % part)
                     else:
                         if not self.variable_in_current_scope(part):
                             # If variable is not found in current or one of the parents'
                             # scopes, then prefix variable with "_c."
+                            last_name[0] = (len(out), '_c', part)
                             out.append('_c.%s' % part)
                         else:
                             out.append(part)
@@ -297,18 +611,139 @@ class CodeGenerator(object):
                     if out:
                         raise CompileException(self._tag, 'Invalid variable')
                     else:
+                        is_path = False
                         out.append('_(%s)' % handle_var(c.children))
 
                 elif c.name == 'pipe':
                     # | is the start of a filter
-                    return handle_filter(''.join(out), children[i+1:])
-            return ''.join(out)
+                    return handle_filter(path(children[:i]), children[i+1:])
+            return path(children)
 
         return handle_var(tree.children)
 
+    def output_variable(self, name):
+        """
+        Output this template variable. When autoescaping is on, the value is
+        escaped at runtime, unless it's known to be safe at compile time.
+        """
+        children = _parse_variable(name).children
+        pipes = [ i for i, c in enumerate(children) if c.name == 'pipe' ]
+
+        # {{ "literal" }} and {{ 8 }}: literals are safe, print them right away.
+        if len(children) == 1 and children[0].name in ('string', 'digits'):
+            literal = children[0].output_as_string()
+            self.write_print(unescape_string_literal(literal) if children[0].name == 'string' else literal)
+            return
+
+        last_filter = children[pipes[-1] + 1].output_as_string() if pipes else None
+
+        if last_filter == 'safe':
+            # {{ var|safe }}: don't mark as safe, just output it.
+            self.write_output(self.convert_variable(
+                        ''.join(c.output_as_string() for c in children[:pipes[-1]])))
+
+        else:
+            code = self.convert_variable(name)
+
+            if last_filter == 'escape':
+                # Output of |escape is escaped, even without autoescaping.
+                self.write_output('_escape(%s)' % code)
+            elif not pipes and self.get_alias(name):
+                self.write_output(code)
+            elif last_filter and self._has_safe_output(last_filter):
+                self.write_output(code)
+            else:
+                self.write_output(self.escape(code))
+
+    def _has_safe_output(self, filter_name):
+        """
+        True when the output of this filter never requires escaping.
+        """
+        if filter_name in _native_filters:
+            return filter_name in _SAFE_NATIVE_FILTERS
+
+        # Only for Django's own filters, not for ones with the same name in
+        # a {% load %}ed library.
+        if filter_name in _SAFE_OUTPUT_FILTERS:
+            constant, func = self.bind_filter(filter_name)
+            try:
+                return func is get_filter(filter_name)
+            except KeyError:
+                return False
+        return False
+
+    def escape(self, code):
+        """
+        Python code for escaping the value of this expression, if
+        autoescaping is on.
+        """
+        return '_escape(%s)' % code if self._autoescape[-1] else code
+
+    def load_libraries(self, modules):
+        """
+        Make the filters of these template tag libraries available.
+        (Called for every {% load %} tag in the template.)
+        """
+        # {% load filter1 filter2 from library %}
+        if 'from' in modules:
+            modules = modules[-1:]
+
+        self._libraries.extend(modules)
+
+    def constant(self, code):
+        """
+        Return the name of a module level constant, for the value of this
+        Python expression. It's evaluated only once, when the template is
+        loaded.
+        """
+        if code not in self._constant_names:
+            self._constant_names[code] = '_k%i' % (len(self._constant_names) + 1)
+            self._constants.append('%s = %s' % (self._constant_names[code], code))
+        return self._constant_names[code]
+
+    def bind_filter(self, name):
+        """
+        Resolve this filter at compile time. Return the name of the module
+        level constant for this filter, and the filter function.
+        """
+        # Filters of the {% load %}ed libraries first. (The last one wins.)
+        # Then our own filters and Django's built-in filters.
+        library = None
+        for l in reversed(self._libraries):
+            if name in _get_library(l).filters:
+                library = l
+                break
+
+        try:
+            func = get_filter(name, library)
+        except KeyError:
+            raise CompileException(self._tag, 'Unknown template filter "%s"' % name)
+
+        key = (library, name)
+        if key not in self._filter_names:
+            self._filter_names[key] = '_f%i' % (len(self._filter_names) + 1)
+            self._constants.append('%s = _filter(%r, %r)' % (self._filter_names[key], name, library))
+
+        return self._filter_names[key], func
+
+    def call_filter(self, name, subject, arg=None):
+        """
+        Python code for calling this (non native) filter.
+        """
+        constant, func = self.bind_filter(name)
+        args = [ subject ]
+
+        if arg:
+            args.append(arg)
+
+        if getattr(func, 'needs_autoescape', False):
+            args.append('autoescape=%s' % self._autoescape[-1])
+
+        return '%s(%s)' % (constant, ', '.join(args))
+
     def get_code(self):
         self._flush_print_cache()
-        return '\n'.join(self._code)
+        return '\n\n'.join(self._constants + self._functions + self._code)
 
 # ==================================[ Registration of template tags and filters ]===================================
 
@@ -338,6 +773,11 @@ def register_native_template_tag(start_tag, *other_tags):
 _filters = { }
 _native_filters = { }
 
+# Filters of which the output never has to be escaped. (Native filters, and
+# Django's built-in filters which always return SafeData.)
+_SAFE_NATIVE_FILTERS = ('length', 'divisibleby')
+_SAFE_OUTPUT_FILTERS = ('escapejs', 'force_escape', 'linebreaks', 'linebreaksbr', 'urlize', 'urlizetrunc')
+
 
 def register_template_filter(name):
     def decorator(func):
@@ -350,6 +790,68 @@ def register_native_template_filter(name):
         _native_filters[name] = func
     return decorator
 
+
+def _get_library(name):
+    from django.template.base import get_library, InvalidTemplateLibrary
+    try:
+        return get_library(name)
+    except InvalidTemplateLibrary, e:
+        raise CompileException(unicode(e))
+
+
+def get_filter(name, library=None):
+    """
+    Return the filter function with this name. From this template tag
+    library when given, otherwise one of our own filters or a Django
+    built-in filter. Raises KeyError when there's no such filter.
+    """
+    if library:
+        return _get_library(library).filters[name]
+
+    if name in _filters:
+        return _filters[name]
+
+    from django.template.base import builtins
+    for lib in reversed(builtins):
+        if name in lib.filters:
+            return lib.filters[name]
+
+    raise KeyError(name)
+
+
+def _is_django_tag(name, libraries=()):
+    """
+    True when Django's template engine knows this tag. (A built-in tag, or
+    a tag from one of these libraries.)
+    """
+    from django.template.base import builtins
+    return any(name in lib.tags for lib in builtins) or \
+                any(name in _get_library(l).tags for l in libraries)
+
+
+def _load_filter(name, library=None):
+    """
+    Filter function for the compiled code. (Called once for every filter,
+    when the template is loaded.) The filter receives the values which
+    are wrapped by a ContextProxy, like Django would pass them.
+    """
+    func = get_filter(name, library)
+    expects_localtime = getattr(func, 'expects_localtime', False)
+    is_safe = getattr(func, 'is_safe', False)
+
+    def call_filter(value, *args, **kwargs):
+        value = _unwrap(value)
+        if expects_localtime:
+            from django.utils.timezone import localtime
+            value = localtime(value)
+        result = func(value, *map(_unwrap, args), **kwargs)
+
+        # The output of an is_safe filter is safe, when its input was.
+        if is_safe and isinstance(value, SafeData):
+            result = mark_safe(result)
+        return result
+    return call_filter
+
 # ==================================[ Compiler main loop ]===================================
 
 def compile_tree(tree):
@@ -381,6 +883,37 @@ def compile_tree(tree):
             with generator.indent():
                 self.render()
 
+        def walk(self, depth=0):
+            """
+            Yield (tagname, args, depth) for every tag, and (None, variable,
+            depth) for every variable in this content, including everything
+            in nested tags. `depth` is the number of {% for %} loops between
+            this content and the tag or variable.
+            """
+            for c in self.content:
+                if isinstance(c, TagFrame):
+                    yield c.start_tag, c.args, depth
+
+                    for content in c.frame_content:
+                        # The {% empty %} block is not part of the loop
+                        nested = (c.start_tag == 'for' and content.tagname == 'for')
+                        for w in content.walk(depth + 1 if nested else depth):
+                            yield w
+
+                elif isinstance(c, VariableFrame):
+                    yield None, c.django_variable.varname, depth
+
+                elif isinstance(c, BlocktransFrame):
+                    for v in c.tag.children:
+                        if isinstance(v, DjangoVariable):
+                            yield None, v.varname, depth
+
+                elif isinstance(c, IncludeFrame):
+                    yield 'include', [ c.tag.template_name ] + [ p.output_as_string() for p in c.tag.with_params ], depth
+
+                elif isinstance(c, DjangoNodeFrame):
+                    yield 'django-node', [ ''.join(c.source) ], depth
+
         @property
         def django_tags(self):
             """ Retreive the DjangoTag objects in this content frame """
@@ -421,6 +954,10 @@ def compile_tree(tree):
                     return
 
         def start_content_block(self, tagname):
+            # Content block of the start tag, even when it's empty.
+            if not self.frame_content:
+                self.frame_content.append(TagFrameContent(self.start_tag))
+
             removed_tag = False
             while not removed_tag and len(self.other_tags):
                 if self.other_tags[0].tagname == tagname:
@@ -447,8 +984,7 @@ def compile_tree(tree):
             self.django_variable = django_variable
 
         def render(self):
-            generator.write('_w(%s)' %
-                    generator.tag_proxy(self.django_variable).convert_variable(self.django_variable.varname))
+            generator.tag_proxy(self.django_variable).output_variable(self.django_variable.varname)
 
     class BlocktransFrame(Frame):
         def __init__(self, tag):
@@ -457,6 +993,28 @@ def compile_tree(tree):
         def render(self):
             handle_blocktrans(generator.tag_proxy(self.tag), self.tag)
 
+    class IncludeFrame(Frame):
+        def __init__(self, tag):
+            self.tag = tag
+
+        def render(self):
+            handle_include(generator.tag_proxy(self.tag), self.tag)
+
+    class DjangoNodeFrame(Frame):
+        """
+        A template tag without native implementation. The source of the tag
+        (and its content) is rendered by Django's template engine.
+        """
+        def __init__(self, tag, end_tagname):
+            self.tag = tag
+            self.tagname = tag.tagname
+            self.end_tagname = end_tagname # None for tags without content
+            self.source = [ tag.output_as_string() ]
+            self.depth = 0 # Nested tags with the same name
+
+        def render(self):
+            handle_django_node(generator.tag_proxy(self.tag), ''.join(self.source))
+
     def run():
         # Push/pop stack for the Django tags.
         stack = [ TagFrame(None, 'document', [ Tag('enddocument') ]) ]
@@ -464,15 +1022,84 @@ def compile_tree(tree):
         def top():
             return stack[-1] if stack else None
 
+        # Tags which are used in this template, to know whether a tag without
+        # native implementation has an end tag.
+        tagnames = set(t.tagname for t in tree.child_nodes_of_class(DjangoTag))
+
+        def in_forloop():
+            """ True when the current tag is inside the body of a {% for %} loop. """
+            return any(isinstance(f, TagFrame) and f.start_tag == 'for' and
+                       f.frame_content[-1].tagname == 'for' for f in stack)
+
+        def compile_container(n, tagname, args, blocks):
+            """
+            Compile a parse tree node with child nodes, like {% if %},
+            as a tag. `blocks` is a list of (tagname, child nodes).
+            """
+            frame = TagFrame(n, tagname, __tags[tagname].tags, args)
+            frame.handler = __tags[tagname]
+            stack.append(frame)
+
+            for i, (block_tagname, children) in enumerate(blocks):
+                if i > 0:
+                    frame.start_content_block(block_tagname)
+                map(_compile, children)
+
+            stack.pop()
+            top().append_content(frame)
+
         def _compile(n):
-            if isinstance(n, DjangoTag):
-                if n.tagname in __tags:
+            if stack and isinstance(top(), DjangoNodeFrame):
+                # Everything until the end tag is rendered by Django.
+                frame = top()
+
+                if isinstance(n, DjangoTag) and n.tagname == frame.tagname:
+                    frame.depth += 1
+
+                elif isinstance(n, DjangoTag) and n.tagname == frame.end_tagname:
+                    if frame.depth == 0:
+                        frame.source.append(n.output_as_string())
+                        stack.pop()
+                        top().append_content(frame)
+                        return
+                    frame.depth -= 1
+
+                frame.source.append(n if isinstance(n, basestring) else n.output_as_string())
+
+            elif isinstance(n, (DjangoIfTag, DjangoIfEqualTag)):
+                tagname = 'if' if isinstance(n, DjangoIfTag) else 'ifequal'
+                blocks = [ (tagname, n.children) ]
+
+                # The {% else %} block
+                if hasattr(n, 'children2'):
+                    blocks.append(('else', n.children2))
+
+                compile_container(n, tagname, [ p.output_as_string() for p in n._params[1:] ], blocks)
+
+            elif isinstance(n, DjangoPreprocessedInclude) and n.with_params:
+                compile_container(n, 'with', [ p.output_as_string() for p in n.with_params ], [ ('with', n.children) ])
+
+            elif isinstance(n, (DjangoBlockTag, DjangoPreprocessedInclude, DjangoPreprocessedCallMacro)):
+                map(_compile, n.children)
+
+            elif isinstance(n, DjangoIncludeTag):
+                top().append_content(IncludeFrame(n))
+
+            elif isinstance(n, DjangoTag):
+                if n.tagname == 'ifchanged' and not in_forloop():
+                    # Outside a loop, Django remembers the previous value
+                    # in the node itself.
+                    stack.append(DjangoNodeFrame(n, 'endifchanged'))
+
+                elif n.tagname in __tags:
                     # Opening of {% tag %}
                     other_tags = __tags[n.tagname].tags
                     frame = TagFrame(n, n.tagname, other_tags, n.args)
                     frame.handler = __tags[n.tagname]
 
                     if other_tags:
+                        # Content block of the start tag, even when it stays empty.
+                        frame.frame_content.append(TagFrameContent(n.tagname))
                         stack.append(frame)
                     else:
                         top().append_content(frame)
@@ -486,6 +1113,16 @@ def compile_tree(tree):
                     # Transition to following content block (e.g. from 'if' to 'else')
                     top().start_content_block(n.tagname)
 
+                elif _is_django_tag(n.tagname, generator._libraries):
+                    # Render through Django's template engine
+                    end_tagname = 'end%s' % n.tagname
+                    frame = DjangoNodeFrame(n, end_tagname if end_tagname in tagnames else None)
+
+                    if frame.end_tagname:
+                        stack.append(frame)
+                    else:
+                        top().append_content(frame)
+
                 else:
                     raise CompileException(n, 'Unknown template tag %s' % n.tagname)
 
@@ -502,7 +1139,10 @@ def compile_tree(tree):
                 # Create blocktrans frame
                 top().append_content(BlocktransFrame(n))
 
-            elif any([ isinstance(n, k) for k in (DjangoPreprocessorConfigTag, DjangoComment, DjangoMultilineComment, DjangoLoadTag, DjangoCompressTag) ]):
+            elif isinstance(n, DjangoLoadTag):
+                generator.load_libraries(n.modules)
+
+            elif any([ isinstance(n, k) for k in (DjangoPreprocessorConfigTag, DjangoComment, DjangoMultilineComment, DjangoCompressTag) ]):
                 pass
 
             elif any([ isinstance(n, k) for k in (DjangoContent, HtmlNode, DjangoRawOutput) ]):
@@ -514,7 +1154,8 @@ def compile_tree(tree):
 
         tree.output(_compile)
 
-        stack[0].render()
+        with generator.function('_c', name='render'):
+            stack[0].render()
 
         return generator.get_code()
     return run()
@@ -542,16 +1183,16 @@ def handle_blocktrans(generator, tag):
 
 
     if variables:
-        generator.write('_w(_("""%s""") %% { %s })' % (
+        generator.write_output('_("""%s""") %% { %s }' % (
                                 ''.join(string).replace('"', r'\"'),
-                                ','.join(['"%s":%s' % (v, generator.convert_variable(v)) for v in variables ])
+                                ','.join(['"%s":%s' % (v, generator.escape(generator.convert_variable(v))) for v in variables ])
                                 ))
     else:
-        generator.write('_w(_("""%s"""))' % ''.join(string))
+        generator.write_output('_("""%s""")' % ''.join(string))
 
     """
     def __(b, c):
-        _w("%(b)s ... %(c)s" % { 'b': b, 'c': c })
+        yield "%(b)s ... %(c)s" % { 'b': b, 'c': c }
     __(_c.a,_c.d)
 
     # {% blocktrans with a as b and d as c %}{{ b }} ... {{ c }}{% endblocktrans %}
@@ -566,22 +1207,21 @@ def register_template_tag(tagname, *other_tags):
     def decorator(func):
         @register_native_template_tag(tagname, *other_tags)
         def native_implementation(generator, args, *content):
-            i = 0
+            functions = []
             for c in content:
-                generator.write('def __%s():' % i)
-                c.render_indented()
-                i += 1
-            generator.write('_call_tag(%s, %s, %s)' %
-                (unicode(args), ','.join(map(lambda i: '__%s' % i, range(0, len(content))))))
+                with generator.function() as f:
+                    c.render()
+                functions.append('lambda: %s' % f.call())
+            generator.write_output_of('_call_tag(%s, %s)' % (unicode(args), ','.join(functions)))
+            generator.invalidate_lookups()
 
             """
-            def __c1():
-                ...
-            def __c2():
+            def _b1(_c):
                 ...
-            def __c3():
+            def _b2(_c):
                 ...
-            _call_tag('tag_handler', args, __c1, __c2, __c3)
+            ...
+                for _o in _call_tag('tag_handler', args, lambda: _b1(_c), lambda: _b2(_c)): yield _o
             """
 
         # TODO: store binding between func and native implementation somewhere.
@@ -596,63 +1236,12 @@ def register_template_tag(tagname, *other_tags):
 
 # ==================================[ Code execution environment ]===================================
 
-class OutputCapture(list):
-    """
-    Simple interface for capturing the output, and stacking
-    several levels of capturing on top of each other.
-
-    We inherit directly from list, for performance reasons.
-    It faster than having a member object of type list, and
-    doing a lookup every time.
-    """
-    def __init__(self):
-        self.sink_array = []
-        self.level = 0
-
-        # Redirect stdout to capture interface
-        # (for parts of code doing print or sys.stdout.write
-        class StdOut(object):
-            def write(s, c):
-                self.append(c)
-
-        self._old_stdout = sys.stdout
-        sys.stdout = StdOut()
-
-    def capture(self):
-        # Copy current list to stack
-        self.sink_array.append(list(self))
-
-        # Create new sink
-        list.__init__(self) # Empty capture list
-
-        self.level += 1
-
-    def __call__(self, c):
-        self.append(c)
+# (type, name) -> lookup which succeeded for this name in an object of this type.
+_ITEM_LOOKUP, _ATTRIBUTE_LOOKUP = 1, 2
+_lookup_strategies = { }
 
-    def end_capture(self):
-        if self.level:
-            # Join last capture
-            result = u''.join(map(unicode,self))
-            self.level -= 1
-
-            # Pop previous capture
-            list.__init__(self)
-            self.extend(self.sink_array.pop())
-
-            return result
-        else:
-            raise Exception("'end_capture' called without any previous call of 'capture'")
-
-    def end_all_captures(self):
-        # Restore stdout
-        sys.stdout = self._old_stdout
-
-        # Return captured content
-        out = ''
-        while self.level:
-            out = self.end_capture()
-        return out
+# Values which ContextProxy._resolve doesn't wrap.
+_PRIMITIVE_TYPES = (basestring, int, long, float)
 
 
 class ContextProxy(object):
@@ -662,7 +1251,9 @@ class ContextProxy(object):
     an attribute or index or callable, we decide at runtime what to do.)
     """
     def __init__(self, context=''):
-        self._context = context or '' # Print an empty string, rather than 'None'
+        if isinstance(context, ContextProxy):
+            context = context._context
+        self._context = '' if context is None else context # Print an empty string, rather than 'None'
 
     def __str__(self):
         return str(self._context)
@@ -702,27 +1293,64 @@ class ContextProxy(object):
             return ContextProxy()
 
     def __getattr__(self, name):
+        return ContextProxy(self._lookup(name))
+
+    def _resolve(self, name, none=''):
+        """
+        Like __getattr__, but primitive values are returned as they are,
+        instead of being wrapped in a new ContextProxy. (The compiled code
+        uses this for the last part of a variable, nothing is looked up in
+        the result anymore.) None values are returned as `none`.
+        """
+        value = self._lookup(name)
+
+        if value is None:
+            return none
+        elif isinstance(value, _PRIMITIVE_TYPES):
+            return value
+        else:
+            return ContextProxy(value)
+
+    def _lookup(self, name):
         # Similar to django.template.Variable._resolve_lookup(context)
         # But minor differences: `var.0' is in our case compiled to var[0]
         # Do we can a quick list index lookup, before dictionary lookup of the string "0".
         c = self._context
+        key = (type(c), name)
+
+        # Use the lookup which succeeded before for this type. When it fails
+        # for this object, do the complete lookup below.
+        strategy = _lookup_strategies.get(key)
+        if strategy:
+            try:
+                attr = c[name] if strategy == _ITEM_LOOKUP else getattr(c, name)
+                if callable(attr): attr = attr()
+                return attr
+            except (IndexError, ValueError, TypeError, KeyError, AttributeError):
+                pass
 
         try:
             attr = c[name]
             if callable(attr): attr = attr()
-            return ContextProxy(attr)
+            _lookup_strategies[key] = _ITEM_LOOKUP
+            return attr
         except (IndexError, ValueError, TypeError, KeyError, AttributeError):
             try:
                 attr = getattr(c, name)
                 if callable(attr): attr = attr()
-                return ContextProxy(attr)
+
+                # Only remember attribute lookups for types which don't
+                # support item lookups at all.
+                if not hasattr(type(c), '__getitem__'):
+                    _lookup_strategies[key] = _ATTRIBUTE_LOOKUP
+                return attr
             except (TypeError, AttributeError):
                 try:
                     attr = c[str(name)]
                     if callable(attr): attr = attr()
-                    return ContextProxy(attr)
+                    return attr
                 except (KeyError, AttributeError, TypeError):
-                    return ContextProxy()
+                    return None
 
     def __getitem__(self, name):
         c = self._context
@@ -742,40 +1370,262 @@ class ContextProxy(object):
 
 
 
+def _include(template_name, c, variables, with_variables, only=False):
+    """
+    Render another template (at runtime), like Django's {% include %} tag.
+    """
+    from django.conf import settings
+    from django.template.loader import get_template
+
+    context = c._context
+    try:
+        if isinstance(template_name, ContextProxy):
+            template_name = template_name._context
+
+        # The name of a template or a Template object
+        if hasattr(template_name, 'render'):
+            template = template_name
+        else:
+            template = get_template(unicode(template_name))
+
+        variables = dict(variables)
+        variables.update(with_variables)
+        variables = dict((k, _unwrap(v)) for k, v in variables.items())
+
+        if only:
+            return template.render(context.new(variables))
+
+        context.update(variables)
+        try:
+            return template.render(context)
+        finally:
+            context.pop()
+    except:
+        if settings.TEMPLATE_DEBUG:
+            raise
+        return u''
+
+
+def _django_nodes(source):
+    """
+    Parse this template source with Django's parser. (Called once, when
+    the compiled template is loaded.)
+    """
+    from django.template import Template as DjangoTemplate
+    return DjangoTemplate(source).nodelist
+
+
+def _render_django_nodes(nodelist, c, variables):
+    """
+    Render a Django NodeList, the template variables of the compiled code
+    are made available in the context.
+    """
+    context = c._context
+    context.update(dict((k, _unwrap(v)) for k, v in variables.items()))
+    try:
+        return nodelist.render(context)
+    finally:
+        assigned = context.pop()
+
+        # Keep variables which were assigned by the tag, like in:
+        # {% get_current_language as LANGUAGE_CODE %}
+        for k, v in assigned.items():
+            if k not in variables:
+                context[k] = v
+
+
+def _regroup(sequence, attribute):
+    """
+    Group consecutive items with the same value for this attribute, like
+    Django's {% regroup %}.
+    """
+    groups = []
+    for item in sequence:
+        grouper = ContextProxy(item)
+        for a in attribute.split('.'):
+            grouper = getattr(grouper, a)
+        grouper = _unwrap(grouper)
+
+        if groups and groups[-1]['grouper'] == grouper:
+            groups[-1]['list'].append(_unwrap(item))
+        else:
+            groups.append({ 'grouper': grouper, 'list': [ _unwrap(item) ] })
+    return groups
+
+
+# Classes of which the values are printed as they are.
+_UNESCAPED_CLASSES = frozenset([ SafeString, SafeUnicode, int, long, float, bool, type(None) ])
+
+def _escape(value):
+    """
+    Escape the output of a variable, like Django's _render_value_in_context
+    when autoescaping is on.
+    """
+    if value.__class__ in _UNESCAPED_CLASSES or isinstance(value, SafeData):
+        return value
+
+    if value.__class__ is not unicode:
+        value = force_unicode(_unwrap(value))
+        if isinstance(value, SafeData):
+            return value
+
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;') \
+                .replace('"', '&quot;').replace("'", '&#39;')
+
+
+def _slice(value, start, stop):
+    """ Like Django's |slice, the result of a safe value is safe. """
+    result = value[start:stop]
+    return mark_safe(result) if isinstance(value, SafeData) else result
+
+
+def _cut(value, arg):
+    """ Like Django's |cut, the result of a safe value is safe. """
+    result = unicode(value).replace(arg, u'')
+    return mark_safe(result) if isinstance(value, SafeData) and arg != ';' else result
+
+
+def _default_if_none(value, default):
+    return default if value is None else value
+
+
+def _unwrap(value):
+    return value._context if isinstance(value, ContextProxy) else value
+
+
 class Template(object):
     """
     Create a Template-compatible object.
     (The API is compatible with django.template.Template, but it wraps around the faster
     template compiled as python code.)
     """
-    def __init__(self, compiled_template_code, filename):
-        from __builtin__ import compile
-        self._code = compiled_template_code
-        self.compiled_template_code = compile(compiled_template_code, 'Python compiled template: %s' % filename, 'exec')
+    # Number of characters render_iter collects before yielding a chunk.
+    buffer_size = 4096
 
-    def render(self, context):
-        a = self._code
-        capture_interface = OutputCapture()
-        capture_interface.capture()
+    def __init__(self, compiled_template_code, filename, code_object=None):
+        """
+        Pass either the generated Python code, or the code object (as
+        returned by load_code_object) of this code.
+        """
+        from __builtin__ import compile
         from django.core.urlresolvers import reverse
 
-        our_globals = {
-            'capture_interface': capture_interface, # Rendered code may call the capture interface.
-            '_w': capture_interface,
-            '_c': ContextProxy(context),
-            '_f': _filters,
+        self._code = compiled_template_code
+        self.compiled_template_code = code_object or compile(compiled_template_code, get_code_filename(filename), 'exec')
+
+        # Execute the code only once, this defines the render function, and
+        # all the functions it calls.
+        # Everything in here is shared between all render calls, so it
+        # should not contain any render state. The context is passed as an
+        # argument of render, and the output is yielded, which makes
+        # rendering thread safe.
+        namespace = {
+            '_filter': _load_filter,
+            '_safe': mark_safe,
+            '_escape': _escape,
+            '_default_if_none': _default_if_none,
+            '_slice': _slice,
+            '_cut': _cut,
+            '_include': _include,
+            '_django_nodes': _django_nodes,
+            '_render_django_nodes': _render_django_nodes,
+            '_regroup': _regroup,
+            '_spaceless': strip_spaces_between_tags,
             '_p': ContextProxy,
             '_for': ForLoop,
             '_cycle': Cycle,
             'reverse':  reverse,
             '_': _,
-            'sys': sys,
         }
+        exec (self.compiled_template_code, namespace, namespace)
+        self._render_function = namespace['render']
+
+    def _render(self, context):
+        """
+        Return a generator which yields the output of this template.
+        """
+        return self._render_function(ContextProxy(context))
+
+    def render(self, context):
+        return u''.join(map(unicode, self._render(context)))
+
+    def render_iter(self, context, buffer_size=None):
+        """
+        Render this template in chunks of at least `buffer_size` characters.
+        (Except for the last chunk.) Usable for streaming the response:
+        HttpResponse(template.render_iter(context))
+        """
+        buffer_size = buffer_size or self.buffer_size
+        buffer = []
+        length = 0
 
-        exec (self.compiled_template_code, our_globals, our_globals)
+        for o in self._render(context):
+            o = unicode(o)
+            buffer.append(o)
+            length += len(o)
 
-        # Return output
-        return capture_interface.end_all_captures()
+            if length >= buffer_size:
+                yield u''.join(buffer)
+                buffer = []
+                length = 0
+
+        if buffer:
+            yield u''.join(buffer)
+
+
+
+# ================================[ Persisted code objects ]================================
+
+# Increase when the generated code or the functions it calls change
+# incompatibly.
+CODE_FORMAT_VERSION = 8
+
+def get_code_filename(filename):
+    return 'Python compiled template: %s' % filename
+
+
+def get_code_fingerprint():
+    """
+    Marshalled code is only valid for the Python version and format version
+    it has been created with.
+    """
+    return sha1('\n'.join([ 'format-%s' % CODE_FORMAT_VERSION, imp.get_magic(), sys.version ])).hexdigest()
+
+
+def save_code_object(path, compiled_template_code, filename):
+    """
+    Compile the generated Python code, and store the marshalled code object.
+    (Like a .pyc file.)
+    """
+    code_object = compile(compiled_template_code, get_code_filename(filename), 'exec')
+
+    f = open(path, 'wb')
+    f.write(get_code_fingerprint() + '\n')
+    marshal.dump(code_object, f)
+    f.close()
+
+
+def load_code_object(path, source_path=None):
+    """
+    Load a marshalled code object. Return None when it does not exist, is
+    older than `source_path`, or was created by another Python version.
+    """
+    if not os.path.exists(path):
+        return None
+
+    if source_path and os.path.getmtime(path) < os.path.getmtime(source_path):
+        return None
+
+    f = open(path, 'rb')
+    try:
+        if f.readline().strip() != get_code_fingerprint():
+            return None
+        try:
+            return marshal.load(f)
+        except (EOFError, ValueError, TypeError), e:
+            return None
+    finally:
+        f.close()
 
 
 
@@ -806,8 +1656,8 @@ def url(generator, args):
 
     # Case 2: print url
     else:
-        prefix = '_w('
-        suffix = ')'
+        prefix = 'yield '
+        suffix = ''
 
     def split_args_and_kwargs(params):
         args = []
@@ -840,7 +1690,7 @@ def with_(generator, args, content):
     """
     {% with a as b and c as d %} ... {% endwith %}
     """
-    pairs = { } # key -> value
+    pairs = [ ] # (key, value)
 
     value = None
     passed_as = False
@@ -850,29 +1700,39 @@ def with_(generator, args, content):
             pass
         elif k == 'as':
             passed_as = True
+        elif '=' in k and not value:
+            # {% with b=a d=c %}
+            pairs.append(tuple(k.split('=', 1)))
         else:
             if passed_as and value:
                 # Remember pair
-                pairs[k] = value
+                pairs.append((k, value))
                 value = None
                 passed_as = False
             elif not value:
                 value = k
             else:
-                raise 'invalid syntax'#TODO
+                raise CompileException(generator.current_tag, 'Invalid {% with %} tag')
+
+    # The values are looked up in the enclosing scope.
+    # Wrap them, they can still be primitive values. (See ContextProxy._resolve.)
+    values = ','.join('_p(%s)' % generator.convert_variable(v) for k, v in pairs)
 
     with generator.scope():
-        for name in pairs.keys():
+        for name, v in pairs:
             generator.register_variable(name);
 
-        generator.write('def __(%s):' % ','.join(pairs.keys()))
-        content.render_indented()
-        generator.write('__(%s)' % ','.join(map(generator.convert_variable, pairs.values())))
+        with generator.function(','.join(k for k, v in pairs)) as f:
+            content.render()
+
+    with generator.push_context(_contains_django_nodes(content)):
+        generator.write_output_of(f.call(values))
 
     """
-    def __(b):
+    def _b1(b, _c):
         ...
-    __(_c.a)
+    ...
+        for _o in _b1(_p(_c._resolve("a")), _c): yield _o
     """
 
 
@@ -881,24 +1741,93 @@ def filter(generator, args, content):
     """
     Native implementation of {% filter ... %} ... {% endfilter %}
     """
-    filter_name, = args
+    filters, = args
 
-    generator.write('_start_capture()')
-    generator.write('def __():')
-    content.render_indented()
-    generator.write('__():')
-    generator.write("print _filters['%s'](_stop_capture())," % filter_name)
+    with generator.function() as f:
+        content.render()
 
+    # The captured output is safe, like the output of a Django NodeList.
+    output = "_safe(u''.join(map(unicode, %s)))" % f.call()
+    for filter_name in filters.split('|'):
+        output = generator.call_filter(filter_name, output)
+    generator.write_output(output)
 
     """
-    _start_capture() # Push stdout stack
-    def __():
+    _f1 = _filter('escape', None)
+    def _b1(_c):
         ...
-    __()
-    print _filters['escape'] (_stop_capture) # Pop stdout stack, call filter, and print
+    ...
+        yield _f1(_safe(u''.join(map(unicode, _b1(_c))))) # Capture output, call filter, and output
     """
 
 
+def handle_include(generator, tag):
+    """
+    {% include template_name %}
+    {% include template_name with a=b c=d only %}
+    (Includes of a fixed template name are already inserted by the
+    preprocessor.)
+    """
+    with_params = [ p.output_as_string() for p in tag.with_params ]
+
+    only = ('only' in with_params)
+    if only:
+        with_params.remove('only')
+
+    variables = [ ]
+    for p in with_params:
+        if '=' not in p:
+            raise CompileException(tag, 'Invalid {% include %} tag')
+        name, value = p.split('=', 1)
+        variables.append('"%s": %s' % (name, generator.convert_variable(value)))
+
+    if tag.template_name_is_variable:
+        template_name = generator.convert_variable(tag.template_name)
+    else:
+        template_name = 'u"%s"' % tag.template_name
+
+    # The included template also sees the variables of this template
+    generator.write_output('_include(%s, _c, %s, { %s }, %s)' % (
+                    template_name,
+                    ('{ }' if only else generator.template_variables()),
+                    ', '.join(variables),
+                    only))
+
+    """
+    yield _include(_c._resolve("name"), _c, { "item": item }, { "a": _c._resolve("b") }, False)
+    """
+
+
+def handle_django_node(generator, source):
+    """
+    Template tag without a native implementation. Render it through Django's
+    template engine. It's parsed only once, when the template is loaded.
+    """
+    libraries = generator._libraries
+    if libraries:
+        source = '{%% load %s %%}%s' % (' '.join(libraries), source)
+
+    nodelist = generator.constant('_django_nodes(%s)' % repr(unicode(source)))
+    generator.write_output('_render_django_nodes(%s, _c, %s)' % (nodelist, generator.template_variables()))
+
+    # The tag could have changed the context
+    generator.invalidate_lookups()
+
+    """
+    _k1 = _django_nodes(u'{% load tags %}{% tag %}...{% endtag %}')
+    ...
+        yield _render_django_nodes(_k1, _c, { "item": item })
+    """
+
+
+def _contains_django_nodes(content):
+    """
+    True when tags in this content are rendered through Django's template
+    engine. (These can assign variables to the context.)
+    """
+    return any(tagname == 'django-node' for tagname, value, depth in content.walk())
+
+
 @register_native_template_tag('if', optional('else'), 'endif')
 def if_(generator, args, content, else_content=None):
     """
@@ -1037,152 +1966,285 @@ def for_(generator, args, content, empty_content=None):
         ...
     {% endfor %}
     """
-    if len(args) > 3:
-        var, in_ = args[0:2]
-        iterator = args[3:]
-    else:
-        var, in_, iterator = args
+    # {% for a, b in iterator reversed %}
+    if 'in' not in args:
+        raise CompileException(generator.current_tag, 'Invalid {% for %} tag')
+
+    in_ = args.index('in')
+    vars = [ v.strip() for v in ' '.join(args[:in_]).split(',') ]
+    iterator = args[in_+1:]
+    reversed_ = (iterator[-1:] == ['reversed'])
+    if reversed_:
+        iterator = iterator[:-1]
+
+    if len(iterator) != 1 or not all(vars):
+        raise CompileException(generator.current_tag, 'Invalid {% for %} tag')
+
+    iterable = generator.convert_variable(iterator[0])
+    if reversed_:
+        iterable = 'list(%s)[::-1]' % iterable
 
     # === Implementation decision ===
 
     # We have two implementations of the forloop
 
     # 1. The Quick forloop. Where the forloop variable is not accessed anywhere
-    #    inside the forloop. And where no empty statement is used.
+    #    inside the forloop, except for the attributes which are known from
+    #    the loop index. (counter, counter0 and first.) These compile to an
+    #    expression of the loop index.
 
-    # 2. The slower, more advanced forloop. Which exposes a forloop object,
-    #    exposes all the forloop properties, and allows usage of {% ifchanged %}
+    # 2. The slower, more advanced forloop. Which exposes a ForLoop object,
+    #    with all the forloop properties, (calculated only when used) and
+    #    allows usage of {% ifchanged %} and forloop.parentloop
     quick_forloop = True
+    uses_index = False
+
+    for tagname, value, depth in content.walk():
+        if tagname and depth == 0:
+            if tagname == 'ifchanged':
+                quick_forloop = False
 
-    if empty_content:
-        quick_forloop = False
+            # Django's template engine needs the forloop object, also to
+            # reset its {% ifchanged %} nodes. The included template could
+            # use it as well.
+            elif tagname == 'include' or (tagname == 'django-node' and
+                        ('forloop' in value[0] or 'ifchanged' in value[0])):
+                quick_forloop = False
 
-    for t in content.django_tags:
-        if t.tagname in ('cycle', 'ifchanged'):
-            quick_forloop = False
+            # Inline {% cycle v1 v2 %} uses forloop.counter0
+            elif tagname == 'cycle' and len(value) > 1 and 'as' not in value:
+                uses_index = True
 
-    for v in content.django_variables:
-        if 'forloop' in v.varname:
-            quick_forloop = False
+        if tagname:
+            value = ' '.join(value)
 
-            # TODO: chooose complex implementation when using {% if forloop.first %} somewhere.
+        for parents, attribute in _FORLOOP_RE.findall(value):
+            parents = parents.count('.parentloop')
 
+            if parents == 0 and depth == 0 and attribute in _QUICK_FORLOOP_ATTRIBUTES:
+                uses_index = True
+
+            # forloop.parentloop of a nested loop, or any other forloop
+            # attribute of this loop requires a ForLoop object.
+            elif parents >= depth:
+                quick_forloop = False
 
     # === implementations ===
 
     if quick_forloop:
-        with generator.scope():
-            generator.register_variable(var);
+        with generator.function() as f:
+            if empty_content:
+                is_empty = generator.unique_name('_e')
+                generator.write('%s = True' % is_empty)
+
+            with generator.scope():
+                for v in vars:
+                    generator.register_variable(v)
+
+                targets = ', '.join(vars)
+
+                if uses_index:
+                    index = generator.unique_name('_i')
+                    generator.register_variable(index)
+                    generator.register_alias('forloop.counter', '(%s + 1)' % index)
+                    generator.register_alias('forloop.counter0', index)
+                    generator.register_alias('forloop.first', '(%s == 0)' % index)
+                    generator.write('for %s, (%s) in enumerate(%s):' % (index, targets, iterable))
+                else:
+                    generator.write('for %s in %s:' % (targets, iterable))
 
-            generator.write('def __():')
-            with generator.indent():
-                generator.write('for %s in %s:' % (var, generator.convert_variable(iterator)))
                 with generator.indent():
-                    generator.write('%s=_p(%s)' % (var, var))
+                    if empty_content:
+                        generator.write('%s = False' % is_empty)
+                    for v in vars:
+                        generator.write('%s=_p(%s)' % (v, v))
                     content.render()
-            generator.write('__()')
+
+            if empty_content:
+                generator.write('if %s:' % is_empty)
+                empty_content.render_indented()
+
+        with generator.push_context(_contains_django_nodes(content)):
+            generator.write_output_of(f.call())
 
     else:
+        # The forloop of the enclosing loop becomes the parentloop
+        parent = 'forloop' if generator.variable_in_current_scope('forloop') else 'None'
+
         # Forloop body
         with generator.scope():
-            generator.register_variable(var);
+            for v in vars:
+                generator.register_variable(v)
             generator.register_variable('forloop');
 
-            generator.write('def __(forloop, %s):' % var)
-            content.render_indented()
+            with generator.function('forloop, %s' % ', '.join(vars)) as f:
+                content.render()
 
         # Empty content body
         if empty_content:
-            generator.write('def __e():')
-            empty_content.render_indented()
+            with generator.function() as e:
+                empty_content.render()
 
         # Forloop initialisation
-        generator.write('_for(%s, __, %s, %s)' % (
-                                generator.convert_variable(iterator),
-                                ('__e' if empty_content else 'None'),
-                                'None' # TODO: pass parentloop, if we have one.
-                            ))
+        with generator.push_context(_contains_django_nodes(content)):
+            generator.write_output_of('_for(%s, %s, %s, %s, (%s,), %s)' % (
+                                    iterable,
+                                    f.name,
+                                    (e.name if empty_content else 'None'),
+                                    parent,
+                                    f.args,
+                                    (len(vars) > 1),
+                                ))
 
     """
     # Quick implementation
-    def __():
-        for item in iterator:
-            print ...
-    __()
+    def _b1(_c):
+        for _i1, (item) in enumerate(iterator):
+            yield ... (_i1 + 1) ...
+    ...
+        for _o in _b1(_c): yield _o
 
     # Advanced
-    def __():
-        for __(forloop):
-            ...(content)...
-        def __e(forloop, item):
-            ...(empty)...
-        --()
-        _for(iterator, __, __e, forloop)
-    __()
+    def _b1(forloop, item, _c):
+        ...(content)...
+    def _b2(_c):
+        ...(empty)...
+    ...
+        for _o in _for(iterator, _b1, _b2, None, (_c,), False): yield _o
     """
 
 
+# forloop references in a template variable: ('.parentloop' * n, attribute)
+_FORLOOP_RE = re.compile(r'\bforloop((?:\.parentloop)*)(?:\.([a-zA-Z0-9_]+))?')
+
+# Forloop attributes which the quick forloop implementation supports.
+_QUICK_FORLOOP_ATTRIBUTES = ('counter', 'counter0', 'first')
+
+_NOTHING = object()
+
+
 class ForLoop(object):
-    def __init__(self, iterator, body, empty_body, parent=None):
+    """
+    Iterating over a ForLoop yields the output of the forloop body for every
+    item, or the output of the empty body when there are no items.
+    The forloop properties are only calculated when they are used.
+    """
+    def __init__(self, iterator, body, empty_body, parent=None, args=(), unpack=False):
+        self._sequence = iterator
         self._iterator = iter(iterator)
-        self._first = True
-        self._last = False
+        self._body = body
+        self._empty_body = empty_body
+        self._args = args # Additional arguments for body and empty_body
+        self._unpack = unpack # Pass the values of every item as separate arguments
         self._parent = parent
         self._counter = 0
-        self._if_changed_storage = { }
+        self._next = _NOTHING # Next item, when it has been read already.
+        self._length = None
+        self._ifchanged_values = { }
 
+    def __iter__(self):
         try:
             # Read first item
             current = self._iterator.next()
+        except StopIteration, e:
+            if self._empty_body:
+                for o in self._empty_body(*self._args):
+                    yield o
+            return
+
+        while True:
+            # Call forloop body
+            if self._unpack:
+                for o in self._body(self, *(map(ContextProxy, current) + list(self._args))):
+                    yield o
+            else:
+                for o in self._body(self, ContextProxy(current), *self._args):
+                    yield o
 
-            # Read next item
-            try:
-                next_ = self._iterator.next()
-            except StopIteration, e:
-                self._last = True
+            # Go to next (which may have been read by `last`)
+            if self._next is _NOTHING:
+                try:
+                    current = self._iterator.next()
+                except StopIteration, e:
+                    return
+            else:
+                current, self._next = self._next, _NOTHING
 
-            while True:
-                # Call forloop body
-                body(self, ContextProxy(current))
+            if current is StopIteration:
+                return
 
-                # Go to next
-                if self._last:
-                    return
-                else:
-                    # Update current
-                    self._counter += 1
-                    current = next_
+            self._counter += 1
 
-                    # Update next (not DRY, but it would cause too much function
-                    # calling overhead otherwise...)
-                    try:
-                        next_ = self._iterator.next()
-                    except StopIteration, e:
-                        self._last = True
+    def _read_next(self):
+        """
+        Read the next item in advance, StopIteration at the end.
+        """
+        if self._next is _NOTHING:
+            try:
+                self._next = self._iterator.next()
+            except StopIteration, e:
+                self._next = StopIteration
 
-        except StopIteration, e:
-            if empty_body:
-                empty_body()
+    def _get_length(self):
+        """
+        Number of items, the remaining items are only read when the sequence
+        doesn't know its length.
+        """
+        if self._length is None:
+            try:
+                self._length = len(self._sequence)
+            except TypeError:
+                self._read_next()
+                if self._next is StopIteration:
+                    self._length = self._counter + 1
+                else:
+                    remaining = list(self._iterator)
+                    self._iterator = iter(remaining)
+                    self._length = self._counter + 2 + len(remaining)
+        return self._length
 
-    @property
-    def _ifchanged(self, varname, new_value):
+    def ifchanged(self, key, value):
         """
-        In-forloop storage for checking wether this value has been changed,
-        compared to last call. Called by {% ifchanged varname %} template tag.
+        True when this value has been changed, compared to the previous call
+        with this key. Called by the {% ifchanged %} template tag.
         """
-        self._if_changed_storage = { }
-        prev_value = self._if_changed_storage.get(varname, None)
-        changed = prev_value != new_value
-        self._if_changed_storage[varname] = new_value
+        changed = self._ifchanged_values.get(key, _NOTHING) != value
+        self._ifchanged_values[key] = value
         return changed
 
+    def __contains__(self, key):
+        # Django's IfChangedNode marks the loop in which it has been rendered.
+        return key in self._ifchanged_values
+
+    def __setitem__(self, key, value):
+        self._ifchanged_values[key] = value
+
+    def __repr__(self):
+        # Like Django's forloop dictionary
+        return repr({
+            'counter': self.counter,
+            'counter0': self.counter0,
+            'revcounter': self.revcounter,
+            'revcounter0': self.revcounter0,
+            'first': self.first,
+            'last': self.last,
+            'parentloop': self._parent or { },
+        })
+
+    def __unicode__(self):
+        return unicode(repr(self))
+
     @property
     def first(self):
-        return self._first
+        return self._counter == 0
 
     @property
     def last(self):
-        raise self._last
+        if hasattr(self._sequence, '__len__'):
+            return self._counter == self._get_length() - 1
+        else:
+            self._read_next()
+            return self._next is StopIteration
 
     @property
     def counter(self):
@@ -1192,20 +2254,25 @@ class ForLoop(object):
     def counter0(self):
         return self._counter
 
+    @property
+    def revcounter(self):
+        return self._get_length() - self._counter
+
     @property
     def revcounter0(self):
-        raise Exception('{{ forloop.revcounter0 }} not yet implemented')
+        return self._get_length() - self._counter - 1
 
     @property
     def parentloop(self):
         return self._parent or ContextProxy()
 
-    def __getattr__(self):
+    def __getattr__(self, name):
         """
         For any undefined property, return this dummy proxy.
         """
         return ContextProxy()
 
+
 class Cycle(object):
     def __init__(self, *args):
         self._args = args
@@ -1214,8 +2281,9 @@ class Cycle(object):
 
     @property
     def next(self):
-        sys.stdout.write(self._args[self._display_counter % self._len ])
+        value = self._args[self._display_counter % self._len ]
         self._display_counter += 1
+        return value
 
 
 @register_native_template_tag('cycle')
@@ -1234,21 +2302,21 @@ def cycle(generator, args):
         if not generator.variable_in_current_scope(varname):
             raise CompileException(generator.current_tag, 'Variable %s has not been defined by a {% cycle %} declaration' % varname)
 
-        generator.write('%s.next' % generator.convert_variable(varname))
+        generator.write_output('%s.next' % generator.convert_variable(varname))
 
     else:
         # How it works: {% for %} should detect wether some {% cycle %} nodes are nested inside
-        if not generator.variable_in_current_scope('forloop'):
+        if not (generator.variable_in_current_scope('forloop') or generator.get_alias('forloop.counter0')):
             raise CompileException(generator.current_tag, '{% cycle %} can only appear inside a {% for %} loop')
 
         args = map(generator.convert_variable, args)
-        generator.write('sys.stdout.write([ %s ][ forloop.counter %% %i ])' % (','.join(args), len(args)))
+        generator.write_output('[ %s ][ %s %% %i ]' % (','.join(args), generator.convert_variable('forloop.counter0'), len(args)))
 
 
     """
     varname = _cycle(v1, v2, v3)
-    varname.next
-    varname = [ v1, v2, v3 ] [ forloop.counter % 3 ]
+    yield varname.next
+    yield [ v1, v2, v3 ] [ forloop.counter0 % 3 ]
     """
 
 
@@ -1258,17 +2326,126 @@ def csrf_token(generator, args):
     # The django implementation checks if _c.csrf_token return 'NOTPROVIDED', and if so, it doesn't print
     # the hidden field. We don't place this if test in the generated code.
     generator.write_print('<div style="display:none"><input type="hidden" name="csrfmiddlewaretoken" value="')
-    generator.write('sys.stdout.write(_c.csrf_token)')
+    generator.write_output('_c.csrf_token')
     generator.write_print('" /></div>')
 
 
+@register_native_template_tag('spaceless', 'endspaceless')
+def spaceless(generator, args, content):
+    """
+    {% spaceless %} ... {% endspaceless %}
+    """
+    with generator.function() as f:
+        content.render()
+
+    generator.write_output("_spaceless(u''.join(map(unicode, %s)).strip())" % f.call())
+
+
+@register_native_template_tag('firstof')
+def firstof(generator, args):
+    """
+    {% firstof var1 var2 "fallback" %}
+    """
+    if not args:
+        raise CompileException(generator.current_tag, '{% firstof %} requires at least one argument')
+
+    generator.write_output('(%s or u"")' % ' or '.join(map(generator.convert_variable, args)))
+
+
+@register_native_template_tag('regroup')
+def regroup(generator, args):
+    """
+    {% regroup people by gender as grouped %}
+    """
+    if len(args) != 5 or args[1] != 'by' or args[3] != 'as':
+        raise CompileException(generator.current_tag, 'Invalid {% regroup %} tag')
+
+    sequence, by, attribute, as_, varname = args
+    generator.register_variable(varname)
+    generator.write('%s = _regroup(%s, "%s")' % (varname, generator.convert_variable(sequence), attribute))
+
+
+@register_native_template_tag('ifchanged', optional('else'), 'endifchanged')
+def ifchanged(generator, args, content, else_content=None):
+    """
+    {% ifchanged %} ... {% endifchanged %}
+    {% ifchanged var1 var2 %} ... {% else %} ... {% endifchanged %}
+    """
+    # The for tag uses the ForLoop implementation when it contains an
+    # {% ifchanged %} tag. It remembers the previous values.
+    if not generator.variable_in_current_scope('forloop'):
+        raise CompileException(generator.current_tag, '{% ifchanged %} can only appear inside a {% for %} loop')
+
+    key = generator.unique_name('ifchanged')
+
+    if args:
+        generator.write('if forloop.ifchanged("%s", (%s,)):' % (key, ','.join(map(generator.convert_variable, args))))
+        content.render_indented()
+    else:
+        # Compare the rendered content
+        with generator.function() as f:
+            content.render()
+
+        output = generator.unique_name('_o')
+        generator.write("%s = u''.join(map(unicode, %s))" % (output, f.call()))
+        generator.write('if forloop.ifchanged("%s", %s):' % (key, output))
+        with generator.indent():
+            generator.write_output(output)
+
+    if else_content:
+        generator.write('else:')
+        else_content.render_indented()
+
+    """
+    if forloop.ifchanged("ifchanged1", (_c.a,)):
+        ...
+    else:
+        ...
+    """
+
+
+_TEMPLATETAG_MAPPING = {
+    'openblock': '{%',
+    'closeblock': '%}',
+    'openvariable': '{{',
+    'closevariable': '}}',
+    'openbrace': '{',
+    'closebrace': '}',
+    'opencomment': '{#',
+    'closecomment': '#}',
+}
+
+
+@register_native_template_tag('templatetag')
+def templatetag(generator, args):
+    """
+    {% templatetag openblock %}
+    """
+    if len(args) != 1 or args[0] not in _TEMPLATETAG_MAPPING:
+        raise CompileException(generator.current_tag, 'Invalid {% templatetag %} tag')
+
+    generator.write_print(_TEMPLATETAG_MAPPING[args[0]])
+
+
+@register_native_template_tag('autoescape', 'endautoescape')
+def autoescape(generator, args, content):
+    """
+    {% autoescape on %} ... {% endautoescape %}
+    """
+    if args not in (['on'], ['off']):
+        raise CompileException(generator.current_tag, 'Invalid {% autoescape %} tag')
+
+    with generator.autoescaping(args[0] == 'on'):
+        content.render()
+
+
 @register_native_template_tag('widthratio')
 def widthratio(generator, args):
     """
     {% widthratio this_value max_value 100 %}
     """
     a, b, c = map(generator.convert_variable, args)
-    generator.write('_w(int(%s / %s * %s))' % (a, b, c))
+    generator.write_output('int(%s / %s * %s)' % (a, b, c))
 
 
 @register_native_template_tag('now')
@@ -1278,12 +2455,11 @@ def now_(generator, args):
     """
     format_, = map(generator.convert_variable, args)
 
-    generator.write('def __():')
-    with generator.indent():
+    with generator.function() as f:
         generator.write('from datetime import datetime')
         generator.write('from django.utils.dateformat import DateFormat')
-        generator.write('sys.stdout.write(DateFormat(datetime.now()).format(%s))' % generator.convert_variable(format_))
-    generator.write('__()')
+        generator.write_output('DateFormat(datetime.now()).format(%s)' % generator.convert_variable(format_))
+    generator.write_output_of(f.call())
 
 
 @register_native_template_tag('call')
@@ -1304,7 +2480,10 @@ def call_template_tag(generator, args):
         func = generator.convert_variable(args[0])
         p = map(generator.convert_variable, args[1:])
 
-        generator.write('sys.stdout.write(%s(%s))' % (func, ','.join(p)))
+        generator.write_output('%s(%s)' % (func, ','.join(p)))
+
+    # The function could have changed the context
+    generator.invalidate_lookups()
 
 
 @register_native_template_tag('get_pingback_url')
@@ -1352,13 +2531,13 @@ def empty(generator, subject, arg):
 @register_native_template_filter('default_if_none')
 def default_if_none(generator, subject, arg):
     """ {{ var|default_if_none:"var" }} """
-        # TODO: may not be the best way, subject can be a complex object, and this causes it to be resolved twice.
-    return '(%s if %s is None else %s)' % (subject, subject, generator.convert_variable(arg))
+    # (Missing variables are None as well.)
+    return '_default_if_none(%s, %s)' % (generator.keep_none(subject), generator.convert_variable(arg))
 
 @register_native_template_filter('cut')
 def cut(generator, subject, arg):
     """ {{ var|cut:" " }} """
-    return 'unicode(%s).replace(%s, '')' % (subject, generator.convert_variable(arg))
+    return "_cut(%s, %s)" % (subject, generator.convert_variable(arg))
 
 @register_native_template_filter('replace')
 def cut(generator, subject, arg):
@@ -1370,9 +2549,9 @@ def cut(generator, subject, arg):
 def slice(generator, subject, arg):
     """ {{ var|slice:":2"}} """
     a,b = arg.strip('"').strip("'").split(':')
-    return '(%s[%s:%s])' % (subject,
-            (int(a) if a else ''),
-            (int(b) if b else ''))
+    return '_slice(%s, %s, %s)' % (subject,
+            (int(a) if a else None),
+            (int(b) if b else None))
 
 
 @register_native_template_filter('divisibleby')
@@ -1395,35 +2574,19 @@ def join(generator, subject, arg):
 @register_native_template_filter('safe')
 def safe(generator, subject, arg):
     """ {{ var|safe }} """
-    return subject # TODO
+    # (As the last filter, the value is just not escaped. See output_variable.)
+    return '_safe(unicode(%s))' % subject
 
 @register_native_template_filter('length')
 def length(generator, subject, arg):
     """ {{ var|length}} """
     return 'len(%s)' % subject
 
-@register_native_template_filter('pluralize')
-def pluralize(generator, subject, arg):
-    """ {{ var|pluralize }} """ # appends 's'
-    """ {{ var|pluralize:"suffix" }} """
-    """ {{ var|pluralize:"single,plural" }} """
-    return subject # TODO
-
-@register_native_template_filter('date')
-def date(generator, subject, arg):
-    """ {{ var|date:format }} """
-    return subject # TODO
-
 @register_native_template_filter('truncate_chars')
 def truncate_chars(generator, subject, arg):
     """ {{ var|truncate_chars:2}} """
     return '%s[:%s]' % (subject, int(arg))
 
-@register_native_template_filter('floatformat')
-def floatformat(generator, subject, arg):
-    """ {{ var|floatformat:"-3" }} """
-    return subject # TODO
-
 
 @register_native_template_filter('prettify_phonenumber')
 def prettify_phonenumber(generator, subject, arg):
@@ -1442,18 +2605,4 @@ def dictsortreversed(generator, subject, arg):
 
 #=================
 
-@register_template_filter('capfirst')
-def capfirst(subject):
-    """ {{ value|capfirst }} """
-    return subject[0].upper() + subject[1:]
-
-
-@register_template_filter('striptags')
-def striptags(subject):
-    """Strips all [X]HTML tags."""
-    from django.utils.html import strip_tags
-    return strip_tags(subject)
-    # TODO make safe string
-
-
 # All django filters can be wrapped as non-native filters...
@@ -0,0 +1,272 @@
+"""
+Author: Jonathan Slenders, City Live
+
+Storage for the render contexts which are remembered by the DebugLoader.
+(So that a webpage can be rendered again when one of the source files has
+been changed.)
+
+The store is bounded: it keeps at most MAX_ENTRIES contexts, drops the least
+recently used one when it's full, and forgets contexts which have not been
+used for TIMEOUT seconds.
+
+-- settings.py --
+TEMPLATE_PREPROCESSOR_CONTEXT_STORE = 'template_preprocessor.template.context_store.LocMemContextStore'
+TEMPLATE_PREPROCESSOR_CONTEXT_STORE_MAX_ENTRIES = 50
+TEMPLATE_PREPROCESSOR_CONTEXT_STORE_TIMEOUT = 300 # seconds
+TEMPLATE_PREPROCESSOR_CONTEXT_STORE_DIR = '/tmp/template-preprocessor-contexts/' # For the FileSystemContextStore
+"""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.template import Context
+from django.utils.importlib import import_module
+
+import os
+import time
+import uuid
+import threading
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+
+class BaseContextStore(object):
+    """
+    Interface for context stores.
+    """
+    def __init__(self, max_entries=50, timeout=300):
+        self.max_entries = max_entries
+        self.timeout = timeout
+
+    def new_key(self):
+        return uuid.uuid4().hex
+
+    def add(self, context):
+        """
+        Store this context, and return it's unique key.
+        """
+        key = self.new_key()
+        self.set(key, context)
+        return key
+
+    def set(self, key, context):
+        raise NotImplementedError
+
+    def get(self, key):
+        """
+        Return the context for this key, or None when it has been evicted.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+
+class LocMemContextStore(BaseContextStore):
+    """
+    Keep the context objects in memory. (For single process debug servers.)
+    """
+    def __init__(self, *args, **kwargs):
+        BaseContextStore.__init__(self, *args, **kwargs)
+        self._entries = { } # key -> [ last_access, context ]
+        self._lock = threading.Lock()
+
+    def set(self, key, context):
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._entries[key] = [ now, context ]
+            if len(self._entries) > self.max_entries:
+                self._cull(now)
+        finally:
+            self._lock.release()
+
+    def get(self, key):
+        now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if now - entry[0] > self.timeout:
+                del self._entries[key]
+                return None
+
+            entry[0] = now
+            return entry[1]
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        self._lock.acquire()
+        try:
+            self._entries.clear()
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cull(self, now):
+        # Expired entries first
+        for key, entry in self._entries.items():
+            if now - entry[0] > self.timeout:
+                del self._entries[key]
+
+        # Then the least recently used ones.
+        if len(self._entries) > self.max_entries:
+            by_access = sorted(self._entries.iteritems(), key=lambda i: i[1][0])
+            for key, entry in by_access[:len(self._entries) - self.max_entries]:
+                del self._entries[key]
+
+
+def _is_lazy(value):
+    """
+    True for values which would be evaluated by pickling them, like QuerySets
+    which have not been evaluated and lazy objects like request.user.
+    """
+    from django.db.models.query import QuerySet
+    from django.utils.functional import LazyObject, empty
+
+    # (Not isinstance: LazyObject proxies __class__ to the wrapped object.)
+    cls = type(value)
+    if issubclass(cls, LazyObject):
+        return value._wrapped is empty
+    if issubclass(cls, QuerySet):
+        return value._result_cache is None
+    return False
+
+
+def _lazy_persistent_id(value):
+    # Lazy values nested in other values are stored as None.
+    return 'lazy' if _is_lazy(value) else None
+
+
+def _dumps(value):
+    f = StringIO()
+    pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = _lazy_persistent_id
+    pickler.dump(value)
+    return f.getvalue()
+
+
+def _loads(data):
+    unpickler = pickle.Unpickler(StringIO(data))
+    unpickler.persistent_load = lambda id: None
+    return unpickler.load()
+
+
+class FileSystemContextStore(BaseContextStore):
+    """
+    Pickle the contexts to a directory, so that they can be shared between
+    processes. Values which can not be pickled (database connections, request
+    objects, ...) are left out, as well as lazy values which would be
+    evaluated by pickling them. (Pickling them would execute queries which
+    the page didn't.)
+    """
+    def __init__(self, directory=None, *args, **kwargs):
+        BaseContextStore.__init__(self, *args, **kwargs)
+        self.directory = directory or getattr(settings, 'TEMPLATE_PREPROCESSOR_CONTEXT_STORE_DIR', None) or \
+                    os.path.join(settings.TEMPLATE_CACHE_DIR, 'debug-contexts')
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def set(self, key, context):
+        # Every value is pickled separately, so that one value which can't
+        # be pickled doesn't prevent storing the others.
+        dicts = []
+        for d in getattr(context, 'dicts', [ context ]):
+            pickled = { }
+            for k, v in d.items():
+                if not _is_lazy(v):
+                    try:
+                        pickled[k] = _dumps(v)
+                    except Exception, e:
+                        pass
+            dicts.append(pickled)
+
+        f = open(self._path(key), 'wb')
+        pickle.dump(dicts, f, pickle.HIGHEST_PROTOCOL)
+        f.close()
+
+        self._cull()
+
+    def get(self, key):
+        path = self._path(key)
+
+        # Only keys as generated by new_key
+        if os.path.basename(key) != key or not os.path.exists(path):
+            return None
+
+        if time.time() - os.path.getmtime(path) > self.timeout:
+            os.remove(path)
+            return None
+
+        # Touch, for LRU eviction. (And the timeout is measured from the last
+        # access, like in the LocMemContextStore.)
+        os.utime(path, None)
+
+        f = open(path, 'rb')
+        try:
+            dicts = pickle.load(f)
+        finally:
+            f.close()
+
+        context = Context()
+        context.dicts = [ dict((k, _loads(v)) for k, v in d.items()) for d in dicts ]
+        return context
+
+    def clear(self):
+        for f in os.listdir(self.directory):
+            os.remove(self._path(f))
+
+    def _cull(self):
+        now = time.time()
+        entries = []
+        for f in os.listdir(self.directory):
+            mtime = os.path.getmtime(self._path(f))
+            if now - mtime > self.timeout:
+                os.remove(self._path(f))
+            else:
+                entries.append((mtime, f))
+
+        if len(entries) > self.max_entries:
+            entries.sort()
+            for mtime, f in entries[:len(entries) - self.max_entries]:
+                os.remove(self._path(f))
+
+
+_context_store = None
+
+def get_context_store():
+    """
+    Return the context store, as configured in settings.py
+    """
+    global _context_store
+
+    if _context_store is None:
+        path = getattr(settings, 'TEMPLATE_PREPROCESSOR_CONTEXT_STORE',
+                    'template_preprocessor.template.context_store.LocMemContextStore')
+        module, classname = path.rsplit('.', 1)
+        try:
+            store_class = getattr(import_module(module), classname)
+        except (ImportError, AttributeError), e:
+            raise ImproperlyConfigured('Error importing context store %s: "%s"' % (path, e))
+
+        _context_store = store_class(
+                    max_entries=getattr(settings, 'TEMPLATE_PREPROCESSOR_CONTEXT_STORE_MAX_ENTRIES', 50),
+                    timeout=getattr(settings, 'TEMPLATE_PREPROCESSOR_CONTEXT_STORE_TIMEOUT', 300))
+
+    return _context_store
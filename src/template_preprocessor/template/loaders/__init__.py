@@ -4,19 +4,24 @@
 
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.template import TemplateDoesNotExist
+from django.template import TemplateDoesNotExist, Template
+from django.template.base import NodeList, TextNode
 from django.template.loader import BaseLoader, get_template_from_string, find_template_loader, make_origin
 from django.utils import translation
 from django.utils.hashcompat import sha_constructor
 from django.utils.importlib import import_module
+from django.utils.safestring import mark_safe
 from django.template import StringOrigin
 
 from template_preprocessor.core import compile
-from template_preprocessor.core.context import Context
-from template_preprocessor.utils import get_options_for_path, execute_precompile_command
+from template_preprocessor.core.context import Context, CompileSession
+from template_preprocessor.template.context_store import get_context_store
+from template_preprocessor.utils import get_options_for_path, execute_precompile_command, load_pickled_template
 
 import os
 import codecs
+import threading
+import time
 
 
 # Override this compiler options for following template loaders
@@ -38,6 +43,13 @@ _OVERRIDE_OPTIONS_AT_DEBUG = [
         ]
 
 
+def _get_mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except (OSError, TypeError), e:
+        return None
+
+
 class _Base(BaseLoader):
     is_usable = True
 
@@ -45,6 +57,12 @@ class _Base(BaseLoader):
         self._loaders = loaders
         self._cached_loaders = []
 
+        # (name, dirs) -> (time, (template, origin) or None, display_name, mtime)
+        self._find_template_cache = { }
+
+        # Shared state for all the templates compiled through this loader.
+        self.session = CompileSession()
+
     @property
     def loaders(self):
         # Resolve loaders on demand to avoid circular imports
@@ -54,10 +72,38 @@ class _Base(BaseLoader):
         return self._cached_loaders
 
     def find_template(self, name, dirs=None):
+        """
+        Find template through the wrapped loaders. Results, also
+        TemplateDoesNotExist, are remembered for
+        TEMPLATE_PREPROCESSOR_FIND_TEMPLATE_CACHE_TIMEOUT seconds, or until
+        the template file has been changed.
+        """
+        key = (name, tuple(dirs) if dirs else None)
+        now = time.time()
+
+        entry = self._find_template_cache.get(key)
+        if entry and now - entry[0] < getattr(settings, 'TEMPLATE_PREPROCESSOR_FIND_TEMPLATE_CACHE_TIMEOUT', 2):
+            created, result, display_name, mtime = entry
+            if result is None:
+                raise TemplateDoesNotExist(name)
+            if mtime is None or _get_mtime(display_name) == mtime:
+                return result
+
+        try:
+            template, display_name, loader = self._find_template(name, dirs)
+        except TemplateDoesNotExist, e:
+            self._find_template_cache[key] = (now, None, None, None)
+            raise
+
+        result = (template, make_origin(display_name, loader.load_template_source, name, dirs))
+        self._find_template_cache[key] = (now, result, display_name, _get_mtime(display_name))
+        return result
+
+    def _find_template(self, name, dirs=None):
         for loader in self.loaders:
             try:
                 template, display_name = loader.load_template_source(name, dirs)
-                return (template, make_origin(display_name, loader.load_template_source, name, dirs))
+                return (template, display_name, loader)
             except TemplateDoesNotExist, e:
                 pass
             except NotImplementedError, e:
@@ -66,6 +112,35 @@ class _Base(BaseLoader):
                             'a loader which returns a template string.)' % unicode(loader))
         raise TemplateDoesNotExist(name)
 
+    def reset(self):
+        "Forget where the templates were found."
+        self._find_template_cache.clear()
+
+
+class _StaticNodeList(NodeList):
+    """
+    NodeList of a static template. Rendering returns the output right away.
+    """
+    def __init__(self, template_string):
+        NodeList.__init__(self, [ TextNode(template_string) ])
+        self.output = mark_safe(template_string)
+
+    def render(self, context):
+        return self.output
+
+
+class StaticTemplate(Template):
+    """
+    Compiled template without any Django tags or variables. Rendering returns
+    the template as is, without walking a nodelist.
+    (Template.render and _render are not overridden: the test runner patches
+    Template._render for sending the template_rendered signal.)
+    """
+    def __init__(self, template_string, origin=None, name='<Unknown Template>'):
+        self.name = name
+        self.origin = origin
+        self.nodelist = _StaticNodeList(template_string)
+
 
 class PreprocessedLoader(_Base):
     """
@@ -87,18 +162,29 @@ class PreprocessedLoader(_Base):
             output_path = os.path.join(self.__cache_dir, lang, template_name)
 
             # Load template
-            if os.path.exists(output_path):
-                # Prefer precompiled version
-                template = codecs.open(output_path, 'r', 'utf-8').read()
-                origin = StringOrigin(template)
+            if os.path.exists(output_path + '-c-static') and os.path.exists(output_path):
+                # Precompiled version without any Django tags or variables.
+                template = StaticTemplate(codecs.open(output_path, 'r', 'utf-8').read(), None, template_name)
+
+            elif os.path.exists(output_path):
+                # Prefer the pickled Template object of the precompiled
+                # version, (created by compile_templates --pickle) this
+                # saves Django from lexing and parsing the template again.
+                template = load_pickled_template(output_path + '-c-pickled', output_path)
+
+                if template is None:
+                    # Precompiled version
+                    template = codecs.open(output_path, 'r', 'utf-8').read()
+                    origin = StringOrigin(template)
+                    template = get_template_from_string(template, origin, template_name)
             else:
                 template, origin = self.find_template(template_name, template_dirs)
 
                 # Compile template (we shouldn't compile anything at runtime.)
                 #template, context = compile(template, loader = lambda path: self.find_template(path)[0], path=template_name)
 
-            # Turn into Template object
-            template = get_template_from_string(template, origin, template_name)
+                # Turn into Template object
+                template = get_template_from_string(template, origin, template_name)
 
             # Save in cache
             self.template_cache[key] = template
@@ -109,6 +195,7 @@ class PreprocessedLoader(_Base):
 
     def reset(self):
         "Empty the template cache."
+        _Base.reset(self)
         self.template_cache.clear()
 
 
@@ -129,7 +216,7 @@ class RuntimeProcessedLoader(_Base):
         # Compile template
         template, context = compile(template, path=template_name, loader = lambda path: self.find_template(path)[0],
                         options=get_options_for_path(origin.name) + self.options,
-                        context_class=self.context_class)
+                        context_class=self.context_class, session=self.session)
 
         # Turn into Template object
         template = get_template_from_string(template, origin, template_name)
@@ -137,8 +224,6 @@ class RuntimeProcessedLoader(_Base):
         # Return result
         return template, None
 
-context_cache = {} # TODO
-
 class DebugLoader(RuntimeProcessedLoader):
     """
     Load templates through the preprocessor. Does validation, compiles and inserts
@@ -168,21 +253,44 @@ class DebugLoader(RuntimeProcessedLoader):
 
     def _store_context(self, context):
         """
-        Store this context in the case, and return it's unique id.
+        Store this context in the context store, and return it's unique id.
         """
-        #from django.core.cache import cache
+        # NOTE: The store is bounded. (See TEMPLATE_PREPROCESSOR_CONTEXT_STORE
+        # settings.) Contexts which are not requested within the timeout are
+        # forgotten.
+        return get_context_store().add(context)
 
-        # TODO: Not yet using the real cache. We need
-        # to build a proxy around context, capture every get call, and
-        # meanwhile build a similar dict/list to be used for next rendering call.
+# Thread local state of the ValidatorLoader. `depth` is larger than zero while
+# a Template is being rendered, or while the ValidatorLoader itself is parsing
+# a template. Templates loaded in that case are loaded by an {% include %} or
+# {% extends %} node, and are already validated as part of their parent.
+_validator_state = threading.local()
 
-        import random, string
-        alphabet = string.ascii_letters
-        key = ''.join([alphabet[random.randint(0, len(string.ascii_letters) - 1)] for __ in range(0, 32)])
+class _nested_load(object):
+    def __enter__(self):
+        _validator_state.depth = getattr(_validator_state, 'depth', 0) + 1
+
+    def __exit__(self, *args):
+        _validator_state.depth -= 1
+
+
+def _wrap_template_render():
+    """
+    Wrap django.template.Template.render, in order to know whether
+    templates are loaded at render time.
+    """
+    from django.template import Template
+
+    if not getattr(Template.render, 'template_preprocessor_wrapper', False):
+        original_render = Template.render
+
+        def render(self, context):
+            with _nested_load():
+                return original_render(self, context)
+
+        render.template_preprocessor_wrapper = True
+        Template.render = render
 
-        #cache.set('tp-context-cache-%s' % key, context)
-        context_cache['tp-context-cache-%s' % key] = context
-        return key
 
 class ValidatorLoader(_Base):
     """
@@ -191,6 +299,32 @@ class ValidatorLoader(_Base):
     when it fails to. But it still returns a Template object of the original
     template, without any caching.
     """
+    def __init__(self, loaders):
+        _Base.__init__(self, loaders)
+        _wrap_template_render()
+
+        # Successful validations: (template_name, source hash, options) -> { dependency: source hash }
+        self._validated = { }
+
+    def _hash_source(self, source):
+        return sha_constructor(source.encode('utf-8')).hexdigest()
+
+    def _is_validated(self, key):
+        """
+        True when this template has been validated before, and none of the
+        templates it depends on has been changed.
+        """
+        if key not in self._validated:
+            return False
+
+        for dependency, source_hash in self._validated[key].iteritems():
+            try:
+                if self._hash_source(self.find_template(dependency)[0]) != source_hash:
+                    return False
+            except TemplateDoesNotExist, e:
+                return False
+        return True
+
     def load_template(self, template_name, template_dirs=None):
         # IMPORTANT NOTE:  We load the template, using the original loaders.
         #                  call compile, but still return the original,
@@ -203,16 +337,23 @@ class ValidatorLoader(_Base):
 
         # Compile template as a test (could raise CompileException), throw away the compiled result.
         try:
-            # Don't compile template when a parent frame was a 'render' method. Than it's probably a
-            # runtime call from an IncludeNode or ExtendsNode.
-            import inspect
-            if not any(i[3] in ('render', 'do_include') for i in inspect.getouterframes(inspect.currentframe())):
+            # Don't compile template when we are rendering, or parsing the
+            # parent template. Than it's a call from an IncludeNode or ExtendsNode.
+            if not getattr(_validator_state, 'depth', 0):
                 # Precompile command
-                print 'compiling %s' % template_name
                 execute_precompile_command()
 
-                compile(template, loader = lambda path: self.find_template(path)[0], path=template_name,
-                            options=get_options_for_path(origin.name) + _OVERRIDE_OPTIONS_FOR_VALIDATION )
+                options = get_options_for_path(origin.name) + _OVERRIDE_OPTIONS_FOR_VALIDATION
+                key = (template_name, self._hash_source(template), tuple(options))
+
+                if not self._is_validated(key):
+                    print 'compiling %s' % template_name
+                    output, context = compile(template, loader = lambda path: self.find_template(path)[0],
+                                path=template_name, options=options, session=self.session)
+
+                    # Remember the dependencies, to know when to validate again.
+                    self._validated[key] = dict((t, self._hash_source(self.find_template(t)[0]))
+                                    for t in context.template_dependencies)
 
         except Exception, e:
             # Print exception on console
@@ -226,7 +367,8 @@ class ValidatorLoader(_Base):
             raise e
 
         # Turn into Template object
-        template = get_template_from_string(template, origin, template_name)
+        with _nested_load():
+            template = get_template_from_string(template, origin, template_name)
 
         # Return template
         return template, None
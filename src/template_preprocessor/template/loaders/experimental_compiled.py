@@ -11,7 +11,7 @@ from django.utils import translation
 from django.utils.hashcompat import sha_constructor
 from django.utils.importlib import import_module
 from django.template import StringOrigin
-from template_preprocessor.render_engine.render import compile_tree, Template
+from template_preprocessor.render_engine.render import compile_tree, load_code_object, Template
 from template_preprocessor.core import compile_to_parse_tree
 
 from template_preprocessor.core import compile
@@ -62,23 +62,30 @@ class Loader(BaseLoader):
         key = '%s-%s' % (lang, template_name)
 
         if key not in self.template_cache:
-            # Path in the cache directory
-            output_path = os.path.join(self.__cache_dir, 'cache', lang, template_name)
-
-            # Load template
-            if os.path.exists(output_path):
-                # Prefer precompiled version
-                template = codecs.open(output_path, 'r', 'utf-8').read()
-                origin = StringOrigin(template)
-            else:
-                template, origin = self.find_template(template_name, template_dirs)
-
-            # Compile template
-            output = compile_to_parse_tree(template, loader = lambda path: self.find_template(path)[0], path=template_name)
+            # Code object, created by the compile_templates_to_code command
+            code_path = os.path.join(self.__cache_dir, 'compiled_to_code', lang, template_name + '-c-code')
+            code_object = load_code_object(code_path)
 
-            # Compile to python
-            output2 = compile_tree(output)
-            template = Template(output2, template_name)
+            if code_object:
+                template = Template(None, template_name, code_object)
+            else:
+                # Path in the cache directory
+                output_path = os.path.join(self.__cache_dir, lang, template_name)
+
+                # Load template
+                if os.path.exists(output_path):
+                    # Prefer precompiled version
+                    template = codecs.open(output_path, 'r', 'utf-8').read()
+                    origin = StringOrigin(template)
+                else:
+                    template, origin = self.find_template(template_name, template_dirs)
+
+                # Compile template
+                output, context = compile_to_parse_tree(template, loader = lambda path: self.find_template(path)[0], path=template_name)
+
+                # Compile to python
+                output2 = compile_tree(output)
+                template = Template(output2, template_name)
 
             # Turn into Template object
             #template = get_template_from_string(template, origin, template_name)
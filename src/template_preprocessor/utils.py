@@ -3,7 +3,19 @@ from django.conf import settings
 from django.template import TemplateDoesNotExist
 
 import os
+import sys
+import glob
+import time
 import codecs
+import copy_reg
+import threading
+import subprocess
+from hashlib import sha1
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
 EXCLUDED_APPS = [ 'debug_toolbar', 'django_extensions' ]
 
@@ -36,47 +48,147 @@ def _get_path_form_app(app):
     return m.__path__[0]
 
 
-def template_iterator():
+def _is_in_directory(path, directory):
     """
-    Iterate through all templates of all installed apps.
-    (Except EXCLUDED_APPS)
+    True when this (normalized) path is the directory itself, or inside it.
+    """
+    return path == directory or path.startswith(directory + os.sep)
+
+
+class _TemplateIndex(object):
+    """
+    Index of all the template files in the TEMPLATE_DIRS and in the templates
+    directories of the INSTALLED_APPS. (In order of precedence.)
     """
-    visited_templates = []
-    def walk(directory):
-        for root, dirs, files in os.walk(directory):
-            for f in files:
-                if not os.path.normpath(os.path.join(root, f)).startswith(settings.TEMPLATE_CACHE_DIR):
-                    if f.endswith('.html'):
-                        yield os.path.relpath(os.path.join(root, f), directory)
+    def __init__(self, directories):
+        self.directories = directories # List of (directory, excluded)
+        self.directory_mtimes = { } # Every walked directory -> mtime
+        self.templates = [ ] # (directory, template) for template_iterator
+        self.paths = { } # Template name -> absolute path of the first match
+
+        cache_dir = os.path.normpath(settings.TEMPLATE_CACHE_DIR)
+        visited_templates = set()
+
+        for directory, excluded in directories:
+            for root, dirs, files in os.walk(directory):
+                # Don't enter the template cache directory
+                dirs[:] = [ d for d in dirs if not _is_in_directory(os.path.normpath(os.path.join(root, d)), cache_dir) ]
+                self.directory_mtimes[root] = os.path.getmtime(root)
+
+                for f in files:
+                    name = os.path.relpath(os.path.join(root, f), directory)
+
+                    if name not in self.paths:
+                        self.paths[name] = os.path.join(directory, name)
 
+                    if not excluded and f.endswith('.html') and name not in visited_templates:
+                        visited_templates.add(name)
+                        self.templates.append((directory, name))
 
-    for dir in settings.TEMPLATE_DIRS:
-        for f in walk(dir):
-            if f in visited_templates:
-                continue
-            visited_templates.append(f)
-            yield dir, f
+    def is_up_to_date(self, directories):
+        """
+        True when no files have been added or removed since building the index.
+        """
+        if directories != self.directories:
+            return False
 
+        for directory, mtime in self.directory_mtimes.iteritems():
+            try:
+                if os.path.getmtime(directory) != mtime:
+                    return False
+            except OSError, e:
+                return False
+
+        # Template directories which did not exist before.
+        return all(d in self.directory_mtimes or not os.path.isdir(d) for d, excluded in directories)
+
+
+_template_index = None
+_template_index_checked = 0 # Time of the last is_up_to_date check
+
+# Minimal number of seconds between two checks of the template directories.
+_TEMPLATE_INDEX_CHECK_INTERVAL = 1
+
+def _get_template_directories():
+    directories = [ (dir, False) for dir in settings.TEMPLATE_DIRS ]
     for app in settings.INSTALLED_APPS:
-        if app not in EXCLUDED_APPS:
-            dir = os.path.join(_get_path_form_app(app), 'templates')
-            for f in walk(dir):
-                if f in visited_templates:
-                    continue
-                visited_templates.append(f)
-                yield dir, f
+        directories.append((os.path.join(_get_path_form_app(app), 'templates'), app in EXCLUDED_APPS))
+    return directories
+
+
+def get_template_index():
+    """
+    Return the template index. It is built again when files have been added to
+    or removed from the template directories. (Checked at most once per
+    _TEMPLATE_INDEX_CHECK_INTERVAL seconds.)
+
+    -- settings.py --
+    # Store the index in the TEMPLATE_CACHE_DIR, and reuse it as long as the
+    # modification times of the template directories are unchanged.
+    TEMPLATE_PREPROCESSOR_PERSIST_TEMPLATE_INDEX = True
+    """
+    global _template_index, _template_index_checked
+
+    now = time.time()
+    if _template_index is not None and now - _template_index_checked >= _TEMPLATE_INDEX_CHECK_INTERVAL:
+        if not _template_index.is_up_to_date(_get_template_directories()):
+            _template_index = None
+        _template_index_checked = now
+
+    if _template_index is None:
+        directories = _get_template_directories()
+
+        if getattr(settings, 'TEMPLATE_PREPROCESSOR_PERSIST_TEMPLATE_INDEX', False):
+            path = os.path.join(settings.TEMPLATE_CACHE_DIR, 'template-index.pickle')
+
+            try:
+                index = pickle.load(open(path, 'rb'))
+                if not index.is_up_to_date(directories):
+                    index = None
+            except Exception, e:
+                index = None
+
+            if index is None:
+                index = _TemplateIndex(directories)
+                if not os.path.isdir(settings.TEMPLATE_CACHE_DIR):
+                    os.makedirs(settings.TEMPLATE_CACHE_DIR)
+                pickle.dump(index, open(path, 'wb'), pickle.HIGHEST_PROTOCOL)
+        else:
+            index = _TemplateIndex(directories)
+
+        _template_index = index
+        _template_index_checked = now
+
+    return _template_index
+
+
+def clear_template_index():
+    """
+    Forget the template index. (Build it again on the next call.)
+    """
+    global _template_index
+    _template_index = None
+
+
+def template_iterator():
+    """
+    Iterate through all templates of all installed apps.
+    (Except EXCLUDED_APPS)
+    """
+    return iter(get_template_index().templates)
+
 
 def get_template_path(template):
     """
     Turn template path into absolute path
     """
-    for dir in settings.TEMPLATE_DIRS:
-        p = os.path.join(dir, template)
-        if os.path.exists(p):
-            return p
+    p = get_template_index().paths.get(template)
+    if p and os.path.exists(p):
+        return p
 
-    for app in settings.INSTALLED_APPS:
-        p = os.path.join(_get_path_form_app(app), 'templates', template)
+    # Not in the index? Maybe it has been created after building the index.
+    for dir, excluded in _get_template_directories():
+        p = os.path.join(dir, template)
         if os.path.exists(p):
             return p
 
@@ -91,19 +203,55 @@ def load_template_source(template):
     return codecs.open(path, 'r', 'utf-8').read()
 
 
+_app_options_table = None
+
+def _get_app_options_table():
+    """
+    Return a dictionary which maps the (normalized, lowercase) template
+    directory of each application which has options in
+    settings.TEMPLATE_PREPROCESSOR_OPTIONS to a list of (position in
+    INSTALLED_APPS, options). Built only once.
+    """
+    global _app_options_table
+
+    if _app_options_table is None:
+        table = { }
+        for i, app in enumerate(settings.INSTALLED_APPS):
+            options = get_options_for_app(app)
+            if options:
+                dir = os.path.normpath(os.path.join(_get_path_form_app(app), 'templates')).lower()
+                table.setdefault(dir, []).append((i, options))
+        _app_options_table = table
+
+    return _app_options_table
+
+
 def get_options_for_path(path):
     """
     return a list of default settings for this template.
     (find app, and return settings for the matching app.)
     """
     result = get_options_for_everyone()
-    for app in settings.INSTALLED_APPS:
-        dir = os.path.normpath(os.path.join(_get_path_form_app(app), 'templates')).lower()
-        if os.path.normpath(path).lower().startswith(dir):
-            result += get_options_for_app(app)
 
-        # NOTE: somehow, we get lowercase paths from the template origin in
-        # Windows, so convert both paths to lowercase before comparing.
+    # Look up every parent directory of this path in the table of
+    # application template directories.
+    # NOTE: somehow, we get lowercase paths from the template origin in
+    # Windows, so convert both paths to lowercase before comparing.
+    table = _get_app_options_table()
+    if table:
+        matches = []
+        dir = os.path.normpath(path).lower()
+        while True:
+            matches += table.get(dir, [])
+            parent = os.path.dirname(dir)
+            if parent == dir:
+                break
+            dir = parent
+
+        # Apply options in the order of INSTALLED_APPS
+        matches.sort()
+        for i, options in matches:
+            result += options
 
     # Disable all HTML extensions if the template name does not end with .html
     # (Can still be overriden in the templates.)
@@ -161,16 +309,184 @@ def get_options_for_app(app):
     return result
 
 
-def execute_precompile_command():
+_precompile_lock = threading.Lock()
+_precompile_state = {
+    'process': None, # Last started process
+    'process_fingerprint': None, # Fingerprint of the input files when this process was started
+    'fingerprint': None, # Fingerprint of the input files of the last successful run
+    'last_check': 0, # Time of the last fingerprint check
+}
+
+def _get_precompile_fingerprint(patterns, method='mtime'):
+    """
+    Return a fingerprint of all the files matching these glob patterns. Either
+    based on the modification time and size of the files ('mtime'), or on
+    their content ('hash').
+    """
+    fingerprint = sha1()
+
+    for path in sorted(set(p for pattern in patterns for p in glob.glob(pattern))):
+        if os.path.isfile(path):
+            fingerprint.update(path)
+            if method == 'hash':
+                fingerprint.update(sha1(open(path, 'rb').read()).hexdigest())
+            else:
+                stat = os.stat(path)
+                fingerprint.update('%r %r' % (stat.st_mtime, stat.st_size))
+
+    return fingerprint.hexdigest()
+
+
+def execute_precompile_command(wait=False):
     """
     Execute precompile command before compiling templates.
     For instance, for compiling CSCC files to CSS first.
 
     -- settings.py --
     TEMPLATE_PREPROCESSOR_PRECOMPILE_COMMAND = 'cd %s; compass compile -c config.rb -q' % ('....path...'))
+
+    # Only run the command when one of these files has been changed.
+    TEMPLATE_PREPROCESSOR_PRECOMPILE_INPUTS = ('/...path.../sass/*.scss', '/...path.../sass/*/*.scss')
+    TEMPLATE_PREPROCESSOR_PRECOMPILE_FINGERPRINT = 'mtime' # or 'hash'
+    TEMPLATE_PREPROCESSOR_PRECOMPILE_INTERVAL = 0 # Minimal number of seconds between two checks.
+
+    The command runs in the background. When it is still running, new calls
+    are ignored, unless `wait` is True, then we wait for the command to finish.
+    When the command fails, it runs again at the next call.
     """
     command = getattr(settings, 'TEMPLATE_PREPROCESSOR_PRECOMPILE_COMMAND', None)
 
     if command:
-        import os
-        os.system(command)
+        patterns = getattr(settings, 'TEMPLATE_PREPROCESSOR_PRECOMPILE_INPUTS', None)
+        if isinstance(patterns, basestring):
+            patterns = [ patterns ]
+
+        with _precompile_lock:
+            process = _precompile_state['process']
+
+            # Coalesce with the command which is still running.
+            if process and process.poll() is None:
+                if wait:
+                    process.wait()
+                else:
+                    return
+
+            # The input files are only processed when the command succeeded.
+            if process and process.returncode == 0:
+                _precompile_state['fingerprint'] = _precompile_state['process_fingerprint']
+
+            # Don't look at the input files too often.
+            now = time.time()
+            if not wait and now - _precompile_state['last_check'] < \
+                        getattr(settings, 'TEMPLATE_PREPROCESSOR_PRECOMPILE_INTERVAL', 0):
+                return
+            _precompile_state['last_check'] = now
+
+            # Don't run when the input files have not been changed.
+            if patterns:
+                fingerprint = _get_precompile_fingerprint(patterns,
+                            getattr(settings, 'TEMPLATE_PREPROCESSOR_PRECOMPILE_FINGERPRINT', 'mtime'))
+                if fingerprint == _precompile_state['fingerprint']:
+                    return
+            else:
+                fingerprint = None
+
+            process = subprocess.Popen(command, shell=True)
+            _precompile_state['process'] = process
+            _precompile_state['process_fingerprint'] = fingerprint
+
+            if wait and process.wait() == 0:
+                _precompile_state['fingerprint'] = fingerprint
+
+
+# Bump this when the layout of the '-c-pickled' files changes.
+PICKLED_TEMPLATE_FORMAT_VERSION = 1
+
+# Settings which influence how Django parses a template into a nodelist.
+_PICKLED_TEMPLATE_SETTINGS = ('INSTALLED_APPS', 'TEMPLATE_DEBUG', 'TEMPLATE_STRING_IF_INVALID',
+                                'USE_I18N', 'USE_L10N')
+
+def get_pickled_template_fingerprint():
+    """
+    Return a hash of the Python and Django version, and the settings which are
+    relevant for parsing templates. A pickled template is only valid for the
+    fingerprint it has been created with.
+    """
+    import django
+
+    parts = [ 'format-%s' % PICKLED_TEMPLATE_FORMAT_VERSION, sys.version, django.get_version() ]
+    for name in _PICKLED_TEMPLATE_SETTINGS:
+        parts.append('%s=%r' % (name, getattr(settings, name, None)))
+
+    return sha1('\n'.join(parts)).hexdigest()
+
+
+def _create_smartif_operator(operator_id):
+    from django.template.smartif import OPERATORS
+    cls = OPERATORS[operator_id]
+    return cls.__new__(cls)
+
+
+def _reduce_smartif_operator(operator):
+    return (_create_smartif_operator, (operator.id, ), operator.__dict__)
+
+
+def _register_smartif_reducers():
+    """
+    The operator nodes of {% if a == b %} and {% if not a %} are instances of
+    classes which are created in django.template.smartif.infix and prefix.
+    They can't be pickled by reference, so pickle them by operator name.
+    """
+    from django.template.smartif import OPERATORS
+    for operator_class in OPERATORS.values():
+        copy_reg.pickle(operator_class, _reduce_smartif_operator)
+
+_register_smartif_reducers()
+
+
+def save_pickled_template(path, template):
+    """
+    Store this django.template.Template object, together with the settings
+    fingerprint. Return False when the nodelist could not be pickled. (Some
+    third party template tags keep references to unpicklable objects.)
+    """
+    try:
+        data = pickle.dumps(template, pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError), e:
+        if os.path.exists(path):
+            os.remove(path)
+        return False
+
+    f = open(path, 'wb')
+    f.write(get_pickled_template_fingerprint() + '\n')
+    f.write(data)
+    f.close()
+    return True
+
+
+def load_pickled_template(path, source_path=None):
+    """
+    Load a pickled django.template.Template object. Return None when there is
+    no pickled version, when it is older than `source_path` (the compiled
+    template), or when it was created by another Django version or with other
+    settings.
+    """
+    if not os.path.exists(path):
+        return None
+
+    if source_path and os.path.getmtime(path) < os.path.getmtime(source_path):
+        return None
+
+    f = open(path, 'rb')
+    try:
+        if f.readline().strip() != get_pickled_template_fingerprint():
+            return None
+        try:
+            return pickle.load(f)
+        except Exception, e:
+            # Unpickling can fail in many ways (removed template tag
+            # modules, renamed classes, ...). Just act as if there was no
+            # pickled version.
+            return None
+    finally:
+        f.close()
@@ -0,0 +1,8 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def shout(value):
+    return unicode(value).upper() + u'!'
@@ -4,3 +4,16 @@ from testapp.tests.test_inheritance import *
 from testapp.tests.test_include import *
 from testapp.tests.test_load import *
 from testapp.tests.test_template_iterator import *
+from testapp.tests.test_pickled_template import *
+from testapp.tests.test_context_store import *
+from testapp.tests.test_validator_loader import *
+from testapp.tests.test_precompile_command import *
+from testapp.tests.test_find_template import *
+from testapp.tests.test_template_index import *
+from testapp.tests.test_options import *
+from testapp.tests.test_compile_session import *
+from testapp.tests.test_if_preprocessing import *
+from testapp.tests.test_static_template import *
+from testapp.tests.test_remove_empty_tags import *
+from testapp.tests.test_preprocessable_tags import *
+from testapp.tests.test_render_engine import *
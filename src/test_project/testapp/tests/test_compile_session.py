@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from django.conf import settings
+
+from template_preprocessor.core import compile
+from template_preprocessor.core.context import CompileSession
+
+
+class TestCompileSession(TestCase):
+
+    def test_preprocess_media_url(self):
+        compiled, context = compile('{{ MEDIA_URL }}img.png', session=CompileSession())
+        self.assertEqual(compiled, '%simg.png' % settings.MEDIA_URL)
+
+    def test_variables_are_resolved_once_per_session(self):
+        calls = []
+
+        class CountingSession(CompileSession):
+            def _get_preprocessable_variables(self):
+                calls.append(1)
+                return CompileSession._get_preprocessable_variables(self)
+
+        session = CountingSession()
+        compile('{{ MEDIA_URL }}', session=session)
+        compile('{{ STATIC_URL }}', session=session)
+        self.assertEqual(len(calls), 1)
+
+    def test_constants_from_settings(self):
+        settings.TEMPLATE_PREPROCESSOR_CONSTANTS = { 'SUPPORT_EMAIL': 'support@example.com' }
+        try:
+            compiled, context = compile('{{ SUPPORT_EMAIL }}', session=CompileSession())
+            self.assertEqual(compiled, 'support@example.com')
+        finally:
+            del settings.TEMPLATE_PREPROCESSOR_CONSTANTS
+
+    def test_registered_variables(self):
+        session = CompileSession()
+        session.register_variable('YEAR', lambda: 2012)
+
+        compiled, context = compile('{{ YEAR }} {{ other }}', session=session)
+        self.assertEqual(compiled, '2012 {{other}}')
+
+    def test_reverse_is_memoized(self):
+        from django.core import urlresolvers
+        from django.utils import translation
+
+        calls = []
+        def reverse(name, args=None, kwargs=None):
+            calls.append((translation.get_language(), name))
+            if name == 'missing':
+                raise urlresolvers.NoReverseMatch(name)
+            return '/%s/%s/' % (translation.get_language(), name)
+
+        original_reverse = urlresolvers.reverse
+        urlresolvers.reverse = reverse
+        try:
+            session = CompileSession()
+
+            translation.activate('en')
+            self.assertEqual(session.reverse('home'), '/en/home/')
+            self.assertEqual(session.reverse('home', args=[]), '/en/home/')
+            self.assertRaises(urlresolvers.NoReverseMatch, session.reverse, 'missing')
+            self.assertRaises(urlresolvers.NoReverseMatch, session.reverse, 'missing')
+            self.assertEqual(calls, [('en', 'home'), ('en', 'missing')])
+
+            # Another language is another cache entry.
+            translation.activate('nl')
+            self.assertEqual(session.reverse('home'), '/nl/home/')
+            self.assertEqual(len(calls), 3)
+        finally:
+            urlresolvers.reverse = original_reverse
+            translation.deactivate()
+
+    def test_translations_are_memoized(self):
+        from django.utils import translation
+
+        calls = []
+
+        class CountingSession(CompileSession):
+            def _get_catalog(self, language):
+                calls.append(language)
+                return CompileSession._get_catalog(self, language)
+
+        session = CountingSession()
+        translation.activate('en')
+        try:
+            compiled, context = compile('{% load i18n %}{% trans "Hello" %}', session=session)
+            self.assertTrue(compiled.endswith('Hello'))
+            compile('{% load i18n %}{% trans "Hello" %}{% blocktrans %}World{% endblocktrans %}', session=session)
+
+            # The catalog is only consulted once for every distinct string.
+            self.assertEqual(calls, ['en', 'en'])
+            self.assertEqual(session.ugettext('Hello'), 'Hello')
+            self.assertEqual(len(calls), 2)
+        finally:
+            translation.deactivate()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+from unittest import TestCase
+
+from django.template import Context
+
+from template_preprocessor.template import context_store
+from template_preprocessor.template.context_store import LocMemContextStore, FileSystemContextStore
+
+
+class FakeTime(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestLocMemContextStore(TestCase):
+
+    def setUp(self):
+        self.time = FakeTime()
+        self._real_time = context_store.time
+        context_store.time = self.time
+
+    def tearDown(self):
+        context_store.time = self._real_time
+
+    def test_store_and_retrieve_context(self):
+        store = LocMemContextStore()
+        context = Context({ 'a': 1 })
+        key = store.add(context)
+        self.assertTrue(store.get(key) is context)
+
+    def test_keys_are_unique(self):
+        store = LocMemContextStore()
+        self.assertNotEqual(store.add(Context()), store.add(Context()))
+
+    def test_least_recently_used_context_is_evicted(self):
+        store = LocMemContextStore(max_entries=2)
+        key1 = store.add(Context())
+        self.time.now += 1
+        key2 = store.add(Context())
+        self.time.now += 1
+        store.get(key1)
+        self.time.now += 1
+        key3 = store.add(Context())
+
+        self.assertEqual(len(store), 2)
+        self.assertTrue(store.get(key1) is not None)
+        self.assertEqual(store.get(key2), None)
+        self.assertTrue(store.get(key3) is not None)
+
+    def test_context_expires_after_timeout(self):
+        store = LocMemContextStore(timeout=10)
+        key = store.add(Context())
+        self.time.now += 11
+        self.assertEqual(store.get(key), None)
+
+    def test_timeout_is_measured_from_the_last_access(self):
+        store = LocMemContextStore(timeout=10)
+        key = store.add(Context())
+        self.time.now += 8
+        self.assertTrue(store.get(key) is not None)
+        self.time.now += 8
+        self.assertTrue(store.get(key) is not None)
+
+
+class TestFileSystemContextStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_picklable_values_are_stored(self):
+        store = FileSystemContextStore(directory=self.directory)
+        key = store.add(Context({ 'a': 1, 'b': lambda: None }))
+
+        context = store.get(key)
+        self.assertEqual(context['a'], 1)
+        self.assertFalse('b' in context)
+
+    def test_unknown_key_returns_none(self):
+        store = FileSystemContextStore(directory=self.directory)
+        self.assertEqual(store.get('unknown'), None)
+        self.assertEqual(store.get('../unknown'), None)
+
+    def test_lazy_values_are_not_evaluated(self):
+        from django.utils.functional import SimpleLazyObject
+
+        evaluated = []
+        def setup():
+            evaluated.append(True)
+            return 'user'
+
+        store = FileSystemContextStore(directory=self.directory)
+        key = store.add(Context({ 'a': 1, 'user': SimpleLazyObject(setup), 'nested': [ SimpleLazyObject(setup) ] }))
+
+        context = store.get(key)
+        self.assertEqual(evaluated, [])
+        self.assertEqual(context['a'], 1)
+        self.assertFalse('user' in context)
+        self.assertEqual(context['nested'], [ None ])
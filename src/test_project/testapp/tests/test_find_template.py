@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from django.template import TemplateDoesNotExist
+
+from template_preprocessor.template.loaders import _Base as BaseLoader
+
+
+class CountingLoader(object):
+    """
+    Template loader which loads templates from a directory, and counts the calls.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.calls = 0
+
+    def load_template_source(self, name, dirs=None):
+        self.calls += 1
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path):
+            raise TemplateDoesNotExist(name)
+        return open(path).read(), path
+
+
+class TestFindTemplateCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'template.html')
+        open(self.path, 'w').write('original')
+
+        self.wrapped_loader = CountingLoader(self.directory)
+        self.loader = BaseLoader(loaders=())
+        self.loader._cached_loaders = [ self.wrapped_loader ]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_found_template_is_remembered(self):
+        self.assertEqual(self.loader.find_template('template.html')[0], 'original')
+        self.assertEqual(self.loader.find_template('template.html')[0], 'original')
+        self.assertEqual(self.wrapped_loader.calls, 1)
+
+    def test_missing_template_is_remembered(self):
+        self.assertRaises(TemplateDoesNotExist, self.loader.find_template, 'missing.html')
+        self.assertRaises(TemplateDoesNotExist, self.loader.find_template, 'missing.html')
+        self.assertEqual(self.wrapped_loader.calls, 1)
+
+    def test_changed_template_is_loaded_again(self):
+        self.loader.find_template('template.html')
+
+        open(self.path, 'w').write('changed')
+        os.utime(self.path, (0, 0))
+
+        self.assertEqual(self.loader.find_template('template.html')[0], 'changed')
+        self.assertEqual(self.wrapped_loader.calls, 2)
+
+    def test_reset_clears_cache(self):
+        self.assertRaises(TemplateDoesNotExist, self.loader.find_template, 'missing.html')
+        open(os.path.join(self.directory, 'missing.html'), 'w').write('new')
+
+        self.loader.reset()
+        self.assertEqual(self.loader.find_template('missing.html')[0], 'new')
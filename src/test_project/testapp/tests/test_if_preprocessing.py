@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from template_preprocessor.core import compile
+from template_preprocessor.core.context import CompileSession
+
+
+class TestIfPreprocessing(TestCase):
+
+    def _compile(self, source):
+        session = CompileSession({ 'DEBUG': False, 'THEME': 'dark' })
+        compiled, context = compile(source, session=session)
+        return compiled
+
+    def test_constant_conditions(self):
+        self.assertEqual(self._compile('{% if DEBUG %}debug{% endif %}'), '')
+        self.assertEqual(self._compile('{% if DEBUG %}debug{% else %}production{% endif %}'), 'production')
+        self.assertEqual(self._compile('{% if not DEBUG and THEME == "dark" %}dark{% endif %}'), 'dark')
+        self.assertEqual(self._compile('{% if 1 %}one{% endif %}'), 'one')
+
+    def test_constant_ifequal(self):
+        self.assertEqual(self._compile('{% ifequal THEME "dark" %}dark{% else %}light{% endifequal %}'), 'dark')
+        self.assertEqual(self._compile('{% ifequal THEME "light" %}light{% endifequal %}'), '')
+
+    def test_nested_conditions(self):
+        self.assertEqual(self._compile('{% if user %}{% if DEBUG %}a{% else %}b{% endif %}{% endif %}'),
+                    '{%if user%}b{%endif%}')
+
+    def test_dynamic_conditions_are_kept(self):
+        self.assertEqual(self._compile('{% if user %}a{% endif %}'), '{%if user%}a{%endif%}')
+        self.assertEqual(self._compile('{% if DEBUG or user %}a{% endif %}'), '{%if DEBUG or user%}a{%endif%}')
+        self.assertEqual(self._compile('{% if THEME|upper %}a{% endif %}'), '{%if THEME|upper%}a{%endif%}')
+        self.assertEqual(self._compile('{% ifequal THEME user.theme %}a{% endifequal %}'),
+                    '{%ifequal THEME user.theme%}a{%endifequal%}')
+
+    def test_invalid_ifequal(self):
+        from template_preprocessor.core.lexer import CompileException
+        self.assertRaises(CompileException, self._compile, '{% ifequal THEME %}a{% endifequal %}')
+
+    def test_disabled(self):
+        compiled = self._compile('{% load template_preprocessor %}{% ! no-if-preprocessing %}{% if DEBUG %}a{% endif %}')
+        self.assertTrue(compiled.endswith('{%if DEBUG%}a{%endif%}'))
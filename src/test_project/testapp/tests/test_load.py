@@ -10,3 +10,22 @@ class TestTemplateLoad(TestCase):
 		compiled, context = compile('{% load url from future %}')
 		compiled = compiled.strip()
 		self.assertEqual(compiled, '{% load url from future%}')
+
+	def test_unused_libraries_are_removed(self):
+		compiled, context = compile('{% load i18n %}{% load template_preprocessor %}{% ! no-html %}<p>{{ value }}</p>')
+		self.assertEqual(compiled, '<p>{{value}}</p>')
+
+	def test_used_libraries_are_kept(self):
+		compiled, context = compile('{% load i18n %}{% load cache %}{% get_current_language as LANG %}{{ LANG }}')
+		self.assertEqual(compiled, '{% load i18n%}{%get_current_language as LANG %}{{LANG}}')
+
+	def test_libraries_of_filter_tags_are_kept(self):
+		compiled, context = compile('{% load testapp_filters %}{% filter shout %}a{% endfilter %}')
+		self.assertTrue(compiled.startswith('{% load testapp_filters%}'))
+
+		from django.template import Template, Context as DjangoContext
+		self.assertEqual(Template(compiled).render(DjangoContext()), 'A!')
+
+	def test_unknown_libraries_are_kept(self):
+		compiled, context = compile('{% load unknown_library %}{{ value }}')
+		self.assertEqual(compiled, '{% load unknown_library%}{{value}}')
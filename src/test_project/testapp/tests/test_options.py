@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import os
+from unittest import TestCase
+
+from django.conf import settings
+
+from template_preprocessor import utils
+from template_preprocessor.core.context import Options
+from template_preprocessor.utils import get_options_for_path
+
+
+class TestOptionsForPath(TestCase):
+
+    def setUp(self):
+        settings.TEMPLATE_PREPROCESSOR_OPTIONS = {
+            '*': ('html',),
+            ('testapp', 'django.contrib.admin'): ('no-html',),
+        }
+        utils._app_options_table = None
+
+    def tearDown(self):
+        del settings.TEMPLATE_PREPROCESSOR_OPTIONS
+        utils._app_options_table = None
+
+    def test_options_of_app(self):
+        path = os.path.join(settings.PROJECT_DIR, 'testapp', 'templates', 'inheritance', 'base.html')
+        self.assertEqual(get_options_for_path(path), ['html', 'no-html'])
+
+    def test_options_of_other_app(self):
+        path = os.path.join(settings.PROJECT_DIR, 'otherapp', 'templates', 'app-template.html')
+        self.assertEqual(get_options_for_path(path), ['html'])
+
+    def test_no_html_for_other_extensions(self):
+        path = os.path.join(settings.PROJECT_DIR, 'otherapp', 'templates', 'script.js')
+        self.assertEqual(get_options_for_path(path), ['html', 'no-html'])
+
+
+class TestOptions(TestCase):
+
+    def test_options_are_applied(self):
+        options = Options.for_options(['no-html', 'no-whitespace-compression'])
+        self.assertFalse(options.is_html)
+        self.assertFalse(options.whitespace_compression)
+
+    def test_options_are_copies(self):
+        options = Options.for_options(['no-html'])
+        options.change('html')
+        self.assertFalse(Options.for_options(['no-html']).is_html)
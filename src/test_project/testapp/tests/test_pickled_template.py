@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from django.conf import settings
+from django.template import Context, StringOrigin
+from django.template.loader import get_template_from_string
+
+from template_preprocessor.utils import save_pickled_template, load_pickled_template
+
+
+class TestPickledTemplate(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'template.html-c-pickled')
+
+        source = '{% if name %}Hello {{ name|upper }}{% endif %}'
+        self.template = get_template_from_string(source, StringOrigin(source), 'template.html')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_pickled_template_renders_like_the_original(self):
+        self.assertTrue(save_pickled_template(self.path, self.template))
+
+        template = load_pickled_template(self.path)
+        self.assertEqual(template.render(Context({ 'name': 'world' })), 'Hello WORLD')
+
+    def test_if_operators_can_be_pickled(self):
+        source = '{% if a == b and not c %}equal{% else %}different{% endif %}{% if a in d %} in{% endif %}'
+        template = get_template_from_string(source, StringOrigin(source), 'template.html')
+        self.assertTrue(save_pickled_template(self.path, template))
+
+        template = load_pickled_template(self.path)
+        self.assertEqual(template.render(Context({ 'a': 1, 'b': 1, 'd': [ 1 ] })), 'equal in')
+        self.assertEqual(template.render(Context({ 'a': 1, 'b': 2, 'd': [] })), 'different')
+
+    def test_missing_pickled_template_returns_none(self):
+        self.assertEqual(load_pickled_template(self.path), None)
+
+    def test_pickled_template_is_invalidated_by_other_settings(self):
+        save_pickled_template(self.path, self.template)
+
+        old_value = settings.TEMPLATE_STRING_IF_INVALID
+        settings.TEMPLATE_STRING_IF_INVALID = 'INVALID'
+        try:
+            self.assertEqual(load_pickled_template(self.path), None)
+        finally:
+            settings.TEMPLATE_STRING_IF_INVALID = old_value
+
+    def test_pickled_template_older_than_source_is_ignored(self):
+        save_pickled_template(self.path, self.template)
+
+        source_path = os.path.join(self.directory, 'template.html')
+        open(source_path, 'w').write('')
+        os.utime(self.path, (0, 0))
+
+        self.assertEqual(load_pickled_template(self.path, source_path), None)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from django.conf import settings
+
+from template_preprocessor import utils
+from template_preprocessor.utils import execute_precompile_command
+
+
+class TestPrecompileCommand(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.directory, 'style.scss')
+        self.output_path = os.path.join(self.directory, 'runs.txt')
+        open(self.input_path, 'w').write('a { }')
+
+        settings.TEMPLATE_PREPROCESSOR_PRECOMPILE_COMMAND = 'echo run >> %s' % self.output_path
+        settings.TEMPLATE_PREPROCESSOR_PRECOMPILE_INPUTS = os.path.join(self.directory, '*.scss')
+        settings.TEMPLATE_PREPROCESSOR_PRECOMPILE_FINGERPRINT = 'hash'
+        utils._precompile_state.update(process=None, process_fingerprint=None, fingerprint=None, last_check=0)
+
+    def tearDown(self):
+        del settings.TEMPLATE_PREPROCESSOR_PRECOMPILE_COMMAND
+        del settings.TEMPLATE_PREPROCESSOR_PRECOMPILE_INPUTS
+        del settings.TEMPLATE_PREPROCESSOR_PRECOMPILE_FINGERPRINT
+        shutil.rmtree(self.directory)
+
+    def runs(self):
+        return len(open(self.output_path).read().split())
+
+    def test_command_only_runs_when_inputs_change(self):
+        execute_precompile_command(wait=True)
+        execute_precompile_command(wait=True)
+        self.assertEqual(self.runs(), 1)
+
+        open(self.input_path, 'w').write('b { }')
+        execute_precompile_command(wait=True)
+        self.assertEqual(self.runs(), 2)
+
+    def test_calls_are_coalesced_while_running(self):
+        settings.TEMPLATE_PREPROCESSOR_PRECOMPILE_COMMAND = 'sleep 0.2; echo run >> %s' % self.output_path
+
+        execute_precompile_command()
+        open(self.input_path, 'w').write('b { }')
+        execute_precompile_command()
+
+        utils._precompile_state['process'].wait()
+        self.assertEqual(self.runs(), 1)
+
+    def test_command_reruns_after_failure(self):
+        settings.TEMPLATE_PREPROCESSOR_PRECOMPILE_COMMAND = 'echo run >> %s; exit 1' % self.output_path
+
+        execute_precompile_command(wait=True)
+        execute_precompile_command(wait=True)
+        self.assertEqual(self.runs(), 2)
+
+    def test_background_run_is_recorded_when_finished(self):
+        execute_precompile_command()
+        utils._precompile_state['process'].wait()
+        self.assertEqual(utils._precompile_state['fingerprint'], None)
+
+        execute_precompile_command()
+        self.assertEqual(self.runs(), 1)
+        self.assertNotEqual(utils._precompile_state['fingerprint'], None)
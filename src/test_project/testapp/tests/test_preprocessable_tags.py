@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from django.conf import settings
+
+from template_preprocessor import preprocess_tag
+from template_preprocessor.core import compile
+from template_preprocessor.core.context import CompileSession
+from template_preprocessor.core.preprocessable_template_tags import NotPreprocessable
+
+
+calls = []
+
+@preprocess_tag('test_cacheable_tag', cacheable=True)
+def _test_cacheable_tag(*args):
+    calls.append(args)
+    if args[1] == '"dynamic"':
+        raise NotPreprocessable()
+    return u'<b>%s</b>' % args[1]
+
+
+class TestPreprocessableTags(TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def test_cacheable_tags_are_memoized(self):
+        session = CompileSession()
+        compiled, context = compile('{% test_cacheable_tag "a" %}{% test_cacheable_tag "a" %}', session=session)
+        self.assertEqual(compiled, '<b>"a"</b><b>"a"</b>')
+
+        compile('{% test_cacheable_tag "a" %}{% test_cacheable_tag "dynamic" %}', session=session)
+        compiled, context = compile('{% test_cacheable_tag "dynamic" %}', session=session)
+        self.assertEqual(compiled, '{%test_cacheable_tag "dynamic" %}')
+        self.assertEqual(len(calls), 2)
+
+    def test_static(self):
+        compiled, context = compile('{% load static %}{% static "img/logo.png" %}{% static path %}')
+        self.assertEqual(compiled, '{%% load static%%}%simg/logo.png{%%static path %%}' % settings.STATIC_URL)
+
+    def test_firstof(self):
+        compiled, context = compile('{% firstof "" 0 "first" "second" %}|{% firstof "" %}|{% firstof "" var "x" %}')
+        self.assertEqual(compiled, 'first||{%firstof "" var "x" %}')
+
+    def test_spaceless(self):
+        compiled, context = compile('{% spaceless %}<p> a </p> <p>b</p>{% endspaceless %}',
+                    options=['no-whitespace-compression'])
+        self.assertEqual(compiled, '<p> a </p><p>b</p>')
+
+        compiled, context = compile('{% spaceless %}<p>{{ a }}</p> <p></p>{% endspaceless %}',
+                    options=['no-whitespace-compression'])
+        self.assertEqual(compiled, '{%spaceless %}<p>{{a}}</p> <p></p>{%endspaceless %}')
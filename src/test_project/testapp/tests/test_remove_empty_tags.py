@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from template_preprocessor.core import compile
+
+
+class TestRemoveEmptyTags(TestCase):
+
+    def test_empty_if_tags(self):
+        compiled, context = compile('a{% if x %}{% endif %}b{% ifequal x y %}{# nothing #}{% else %}{% endifequal %}c')
+        self.assertEqual(compiled, 'abc')
+
+    def test_empty_block_tags(self):
+        compiled, context = compile('a{% with x as y %}{% spaceless %}{% endspaceless %}{% endwith %}b')
+        self.assertEqual(compiled, 'ab')
+
+    def test_non_empty_tags_are_kept(self):
+        compiled, context = compile('{% if x %}a{% endif %}{% with x as y %}{{ y }}{% endwith %}')
+        self.assertEqual(compiled, '{%if x%}a{%endif%}{%with x as y %}{{y}}{%endwith %}')
+
+    def test_disabled(self):
+        compiled, context = compile('a{% if x %}{% endif %}b', options=['no-remove-empty-tags'])
+        self.assertEqual(compiled, 'a{%if x%}{%endif%}b')
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from django.template import Context
+
+from template_preprocessor.core import compile_to_parse_tree
+from template_preprocessor.render_engine.render import compile_tree, Template
+
+
+def _template(source):
+    tree, context = compile_to_parse_tree(source, options=['no-html'])
+    return Template(compile_tree(tree), 'test')
+
+
+class TestRenderEngine(TestCase):
+
+    def setUp(self):
+        self.context = Context({ 'name': 'world', 'items': [1, 2, 3], 'empty': [] })
+
+    def test_render(self):
+        template = _template('<p>Hello {{ name }}</p>{% for i in items %}<i>{{ i }}</i>{% endfor %}')
+        self.assertEqual(template.render(self.context), '<p>Hello world</p><i>1</i><i>2</i><i>3</i>')
+
+    def test_forloop(self):
+        template = _template('{% for i in items %}{{ forloop.counter }}{% cycle "a" "b" %}{% endfor %}'
+                        '{% for i in empty %}{% empty %}empty{% endfor %}')
+        self.assertEqual(template.render(self.context), '1a2b3aempty')
+
+    def test_forloop_attributes(self):
+        def items():
+            for i in 'abc':
+                yield i
+
+        template = _template('{% for i in items %}{{ i }}{{ forloop.revcounter }}{{ forloop.revcounter0 }}'
+                        '{{ forloop.last }} {% endfor %}')
+        self.assertEqual(template.render(Context({ 'items': items() })), 'a32False b21False c10True ')
+
+        template = _template('{% for i in items %}{% for j in items reversed %}{{ forloop.parentloop.counter }}{{ j }} '
+                        '{% endfor %}{% endfor %}|{% for a, b in pairs %}{{ a }}={{ b }}{% endfor %}')
+        self.assertEqual(template.render(Context({ 'items': [1, 2], 'pairs': [(1, 2)] })), '12 11 22 21 |1=2')
+
+    def test_forloop_output(self):
+        template = _template('{% autoescape off %}{% for i in items %}{% for j in items %}{{ forloop }}{% endfor %}'
+                        '{% endfor %}{% endautoescape %}')
+        output = template.render(Context({ 'items': [1] }))
+        self.assertTrue("'counter': 1" in output)
+        self.assertTrue("'parentloop': {" in output)
+        self.assertFalse('ForLoop' in output)
+
+    def test_quick_forloop(self):
+        tree, context = compile_to_parse_tree('{% for i in items %}{{ forloop.counter }}{% cycle "a" "b" %}'
+                        '{{ forloop.first }}{% empty %}empty{% endfor %}', options=['no-html'])
+        code = compile_tree(tree)
+
+        # No ForLoop object required
+        self.assertTrue('enumerate(' in code)
+        self.assertFalse('_for(' in code)
+
+        self.assertEqual(Template(code, 'test').render(self.context), '1aTrue2bFalse3aFalse')
+        self.assertEqual(Template(code, 'test').render(Context({ 'items': [] })), 'empty')
+
+    def test_nested_captures(self):
+        template = _template('{% with name as n %}{% filter capfirst %}{{ n }}{% endfilter %}{% endwith %}')
+        self.assertEqual(template.render(self.context), 'World')
+
+    def test_hoisted_functions(self):
+        tree, context = compile_to_parse_tree('{% for i in items %}{% for j in items %}{{ i }}{{ j }},{% endfor %}'
+                        '{% with i as k %}[{{ k }}]{% endwith %}{% endfor %}', options=['no-html'])
+        code = compile_tree(tree)
+
+        # Only module level functions
+        self.assertEqual([ l for l in code.splitlines() if l.strip().startswith('def ') and l.startswith('\t') ], [])
+
+        self.assertEqual(Template(code, 'test').render(Context({ 'items': [1, 2] })), '11,12,[1]21,22,[2]')
+
+    def test_hoisted_lookups(self):
+        tree, context = compile_to_parse_tree('{{ user.name }}{% for i in items %}{{ i.x }}{{ user.name }}{{ i.x }}{% endfor %}'
+                        '{{ user.name }}', options=['no-html'])
+        code = compile_tree(tree)
+
+        # Looked up once in render, and once in every iteration of the loop
+        self.assertEqual(code.count('_c.user._resolve("name")'), 2)
+        self.assertEqual(code.count('i.x'), 1)
+
+        context = Context({ 'user': { 'name': 'me' }, 'items': [ { 'x': 1 }, { 'x': 2 } ] })
+        self.assertEqual(Template(code, 'test').render(context), 'me1me12me2me')
+
+    def test_context_proxy(self):
+        from template_preprocessor.render_engine.render import ContextProxy, _lookup_strategies, _ATTRIBUTE_LOOKUP
+
+        class User(object):
+            def __init__(self, name):
+                self.name = name
+
+        proxy = ContextProxy({ 'user': User('me'), 'count': 0 })
+        self.assertEqual(proxy.user._resolve('name'), 'me')
+        self.assertEqual(_lookup_strategies[(User, 'name')], _ATTRIBUTE_LOOKUP)
+
+        # Primitive values are not wrapped, None is printed as an empty string
+        self.assertEqual(type(ContextProxy({ 'user': User(u'you') }).user._resolve('name')), unicode)
+        self.assertEqual(proxy._resolve('count'), 0)
+        self.assertEqual(ContextProxy({ 'user': User(None) }).user._resolve('name'), '')
+
+        # Fall back to the other lookups when the remembered one fails
+        self.assertEqual(unicode(ContextProxy({ 'user': { 'name': 'dict' } }).user.name), 'dict')
+        self.assertEqual(unicode(proxy.missing.name), '')
+
+    def test_falsy_values(self):
+        # 0, False and '' print the same, however they are looked up
+        template = _template('{{ a }}|{% with a as b %}{{ b }}{% endwith %}|{% for i in items %}{{ i }}{% endfor %}|{{ items.0 }}')
+        for value, output in ((0, '0'), (False, 'False'), ('', '')):
+            context = Context({ 'a': value, 'items': [ value ] })
+            self.assertEqual(template.render(context), '|'.join([ output ] * 4))
+
+    def test_filters(self):
+        import datetime
+        from template_preprocessor.core.lexer import CompileException
+
+        tree, context = compile_to_parse_tree('{{ name|upper }} {{ name|upper|truncatewords:1 }} {{ date|date:"Y-m" }} '
+                        '{{ text|linebreaksbr }}', options=['no-html'])
+        code = compile_tree(tree)
+
+        # Every filter is bound only once, when the template is loaded.
+        self.assertEqual(code.count("_filter(u'upper', None)"), 1)
+        self.assertTrue('_safe(u"Y-m")' in code)
+
+        context = Context({ 'name': 'hello world', 'date': datetime.date(2013, 7, 1), 'text': 'a\nb' })
+        self.assertEqual(Template(code, 'test').render(context), 'HELLO WORLD HELLO ... 2013-07 a<br />b')
+
+        # Django's own filters, also for empty and non-string values
+        template = _template('[{{ missing|capfirst }}][{{ number|capfirst }}][{{ html|striptags }}]')
+        self.assertEqual(template.render(Context({ 'number': 5, 'html': '<b>bold</b>' })), '[][5][bold]')
+
+        tree, context = compile_to_parse_tree('{{ name|unknown_filter }}', options=['no-html'])
+        self.assertRaises(CompileException, compile_tree, tree)
+
+    def test_builtin_tags(self):
+        context = Context({ 'a': 1, 'none': None, 'text': '<a>\nb',
+                    'people': [ { 'g': 'm', 'n': 'bob' }, { 'g': 'm', 'n': 'jim' }, { 'g': 'f', 'n': 'ann' } ] })
+
+        template = _template('{% if a %}A{% else %}B{% endif %}{% if not a %}C{% endif %}{% ifequal a 1 %}one{% endifequal %}')
+        self.assertEqual(template.render(context), 'Aone')
+
+        template = _template('{% for p in people %}{% ifchanged p.g %}[{{ p.g }}]{% endifchanged %}'
+                        '{% ifchanged %}<{{ p.n|length }}>{% endifchanged %}{{ p.n }} {% endfor %}')
+        self.assertEqual(template.render(context), '[m]<3>bob [m]jim [f]ann ')
+
+        # Outside a loop, {% ifchanged %} is rendered by Django
+        template = _template('{% ifchanged a %}[{{ a }}]{% endifchanged %}{% for p in empty %}{% empty %}'
+                        '{% ifchanged %}empty{% endifchanged %}{% endfor %}')
+        self.assertEqual(template.render(context), '[1]empty')
+
+        # Django's {% ifchanged %} inside a loop is reset by the ForLoop object
+        template = _template('{% load l10n %}{% for p in people %}{% localize on %}{% ifchanged p.g %}[{{ p.g }}]'
+                        '{% endifchanged %}{% endlocalize %}{% endfor %}')
+        loop_context = Context({ 'people': [ { 'g': 'm' }, { 'g': 'f' }, { 'g': 'm' } ] })
+        self.assertEqual(template.render(loop_context), '[m][f][m]')
+        self.assertEqual(template.render(loop_context), '[m][f][m]')
+
+        template = _template('{% regroup people by g as grouped %}{% for x in grouped %}{{ x.grouper }}:'
+                        '{% for p in x.list %}{{ p.n }},{% endfor %};{% endfor %}')
+        self.assertEqual(template.render(context), 'm:bob,jim,;f:ann,;')
+
+        template = _template('{% firstof none "fallback" %}{% templatetag openblock %}'
+                        '{% spaceless %}<p> <b>{{ a }}</b> </p>{% endspaceless %}')
+        self.assertEqual(template.render(context), 'fallback{%<p><b>1</b></p>')
+
+        template = _template('{% autoescape off %}{{ text|linebreaksbr }}{% endautoescape %}{{ text|linebreaksbr }}')
+        self.assertEqual(template.render(context), '<a><br />b&lt;a&gt;<br />b')
+
+        template = _template('{% with x=a y=people %}{{ x }}{{ y|length }}{% endwith %}')
+        self.assertEqual(template.render(context), '13')
+
+    def test_autoescape(self):
+        from django.utils.safestring import mark_safe
+
+        class Widget(object):
+            def __unicode__(self):
+                return mark_safe(u'<input />')
+
+        context = Context({ 'text': '<a href="?a&b">', 'safe': mark_safe('<b>'), 'number': 5,
+                    'widget': Widget(), 'items': [ '<i>' ] })
+
+        template = _template('{{ text }} {{ safe }} {{ number }} {{ widget }} {{ "<literal>" }} {{ text|safe }} '
+                        '{{ text|upper }} {{ text|length }}{% for i in items %} {{ i }}{{ forloop.counter }}{% endfor %}')
+        self.assertEqual(template.render(context), '&lt;a href=&quot;?a&amp;b&quot;&gt; <b> 5 <input /> <literal> '
+                        '<a href="?a&b"> &lt;A HREF=&quot;?A&amp;B&quot;&gt; 15 &lt;i&gt;1')
+
+        # String literals in the arguments of (native) filters are safe
+        template = _template('{{ missing|default:"&nbsp;" }} {{ none|default_if_none:"&mdash;" }} '
+                        '{{ text|default:"&nbsp;" }} {{ text|default_if_none:"&mdash;" }}')
+        self.assertEqual(template.render(Context({ 'none': None, 'text': '&' })), '&nbsp; &mdash; &amp; &amp;')
+
+        # The output of is_safe filters is safe when their input is
+        template = _template('{{ safe|slice:":3" }} {{ safe|last }} {{ safe|cut:"b" }} {{ text|slice:":2" }}')
+        self.assertEqual(template.render(context), '<b> > <> &lt;a')
+
+        template = _template('{% autoescape off %}{{ text }} {{ text|escape }}{% endautoescape %} {{ text|force_escape }}')
+        self.assertEqual(template.render(context), '<a href="?a&b"> &lt;a href=&quot;?a&amp;b&quot;&gt; '
+                        '&lt;a href=&quot;?a&amp;b&quot;&gt;')
+
+        # Escaping is left out of the code for values which are known to be safe.
+        tree, context = compile_to_parse_tree('{{ "<literal>" }}{{ text|safe }}{{ text|linebreaksbr }}'
+                        '{% for i in items %}{{ forloop.counter }}{% endfor %}', options=['no-html'])
+        self.assertFalse('_escape(' in compile_tree(tree))
+
+    def test_include(self):
+        template = _template('{% for p in people %}{% include name with z=p %}{% endfor %}')
+        context = Context({ 'name': 'render_engine/include.html', 'people': [ 'bob', 'ann' ] })
+        self.assertEqual(template.render(context), 'bob1,ann2,')
+
+    def test_django_nodes(self):
+        # Tags without a native implementation are rendered by Django.
+        template = _template('{% load i18n %}{% get_current_language as LANG %}{{ LANG }}'
+                        '{% for i in items %}{% comment %}{{ i }}{% endcomment %}{% endfor %}')
+        self.assertEqual(template.render(self.context), 'en-us')
+
+        # Variables assigned in a loop or with scope are not visible after it
+        template = _template('{% load i18n %}{% for i in items %}{% get_current_language as L %}{% endfor %}[{{ L }}]'
+                        '{% with name as n %}{% get_current_language as M %}{{ M }}{% endwith %}[{{ M }}]')
+        self.assertEqual(template.render(self.context), '[]en-us[]')
+
+    def test_render_iter(self):
+        template = _template('{% for i in items %}<i>{{ i }}</i>{% endfor %}')
+
+        chunks = list(template.render_iter(self.context, buffer_size=8))
+        self.assertEqual(chunks, ['<i>1</i>', '<i>2</i>', '<i>3</i>'])
+        self.assertEqual(u''.join(template.render_iter(self.context)), template.render(self.context))
+
+    def test_render_in_threads(self):
+        import threading
+
+        templates = [
+            _template('{% for i in items %}{{ name }}{{ i }}{% cycle "a" "b" %}{% endfor %}'),
+            _template('{% with name as n %}{% filter capfirst %}{{ n }}{% endfilter %}{% endwith %}'),
+        ]
+        errors = []
+
+        def render(thread_id):
+            try:
+                for i in range(50):
+                    name = 'thread%s-%s' % (thread_id, i)
+                    items = range(1, thread_id % 4 + 1)
+                    context = Context({ 'name': name, 'items': items })
+                    expected = [
+                        u''.join('%s%s%s' % (name, j, 'ab'[(j - 1) % 2]) for j in items),
+                        name.capitalize(),
+                    ]
+                    outputs = [ t.render(context) for t in templates ]
+                    if outputs != expected:
+                        errors.append((outputs, expected))
+            except Exception, e:
+                errors.append(e)
+
+        threads = [ threading.Thread(target=render, args=(i,)) for i in range(20) ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+
+    def test_code_object(self):
+        import os
+        import shutil
+        import tempfile
+        from template_preprocessor.render_engine import render
+
+        tree, context = compile_to_parse_tree('<p>Hello {{ name }}</p>', options=['no-html'])
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'hello.html-c-code')
+        try:
+            render.save_code_object(path, compile_tree(tree), 'hello.html')
+
+            template = Template(None, 'hello.html', render.load_code_object(path))
+            self.assertEqual(template.render(self.context), '<p>Hello world</p>')
+
+            # Another format version
+            render.CODE_FORMAT_VERSION += 1
+            try:
+                self.assertEqual(render.load_code_object(path), None)
+            finally:
+                render.CODE_FORMAT_VERSION -= 1
+        finally:
+            shutil.rmtree(directory)
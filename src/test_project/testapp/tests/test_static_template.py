@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from django.template import Context, Template
+from django.utils import translation
+
+from template_preprocessor.core import compile
+from template_preprocessor.template.loaders import PreprocessedLoader, StaticTemplate
+
+
+class TestStaticTemplate(TestCase):
+
+    def test_static_output_is_detected(self):
+        output, context = compile('<p>{{ MEDIA_URL }}</p>{% comment %}nothing{% endcomment %}')
+        self.assertTrue(context.is_static)
+
+        output, context = compile('<p>{{ name }}</p>')
+        self.assertFalse(context.is_static)
+
+    def test_static_template_renders_its_source(self):
+        template = StaticTemplate('<p>Hello</p>', None, 'hello.html')
+        self.assertEqual(template.render(Context({ 'name': 'world' })), '<p>Hello</p>')
+
+    def test_static_template_sends_template_rendered(self):
+        from django.test.signals import template_rendered
+        from django.test.utils import setup_test_environment, teardown_test_environment
+
+        rendered = []
+        def receiver(sender, template, context, **kwargs):
+            rendered.append(template)
+
+        template = StaticTemplate('<p>Hello</p>', None, 'hello.html')
+        instrumented = hasattr(Template, '_original_render')
+        if not instrumented:
+            setup_test_environment()
+
+        template_rendered.connect(receiver)
+        try:
+            self.assertEqual(template.render(Context()), '<p>Hello</p>')
+        finally:
+            template_rendered.disconnect(receiver)
+            if not instrumented:
+                teardown_test_environment()
+
+        self.assertEqual(rendered, [ template ])
+
+    def test_preprocessed_loader_returns_static_template(self):
+        directory = tempfile.mkdtemp()
+        try:
+            os.mkdir(os.path.join(directory, 'en'))
+            open(os.path.join(directory, 'en', 'hello.html'), 'w').write('<p>Hello</p>')
+            open(os.path.join(directory, 'en', 'hello.html-c-static'), 'w').close()
+
+            loader = PreprocessedLoader([])
+            loader._PreprocessedLoader__cache_dir = directory
+
+            translation.activate('en')
+            try:
+                template, origin = loader.load_template('hello.html')
+            finally:
+                translation.deactivate()
+
+            self.assertTrue(isinstance(template, StaticTemplate))
+            self.assertEqual(template.render(Context()), '<p>Hello</p>')
+        finally:
+            shutil.rmtree(directory)
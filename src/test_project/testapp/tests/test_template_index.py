@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist
+
+from template_preprocessor import utils
+from template_preprocessor.utils import get_template_index, clear_template_index, get_template_path
+
+
+class TestTemplateIndex(TestCase):
+
+    def setUp(self):
+        clear_template_index()
+
+    def tearDown(self):
+        clear_template_index()
+
+    def test_index_is_built_once(self):
+        self.assertTrue(get_template_index() is get_template_index())
+
+    def test_get_template_path_prefers_template_dirs(self):
+        self.assertEqual(get_template_path('project-template.html'),
+                         os.path.join(settings.TEMPLATE_DIRS[0], 'project-template.html'))
+
+    def test_get_template_path_of_missing_template(self):
+        self.assertRaises(TemplateDoesNotExist, get_template_path, 'notfound_template.html')
+
+    def test_index_is_rebuilt_when_templates_are_added(self):
+        old_template_dirs = settings.TEMPLATE_DIRS
+        directory = tempfile.mkdtemp()
+        settings.TEMPLATE_DIRS = (directory, ) + tuple(old_template_dirs)
+        try:
+            os.utime(directory, (0, 0))
+            self.assertNotEqual(get_template_path('app-template.html'), os.path.join(directory, 'app-template.html'))
+
+            # A template in a directory with a higher precedence
+            open(os.path.join(directory, 'app-template.html'), 'w').write('')
+            utils._template_index_checked = 0
+
+            self.assertEqual(get_template_path('app-template.html'), os.path.join(directory, 'app-template.html'))
+            self.assertTrue((directory, 'app-template.html') in list(utils.template_iterator()))
+        finally:
+            shutil.rmtree(directory)
+            settings.TEMPLATE_DIRS = old_template_dirs
+
+    def test_persisted_index_is_reused_until_a_directory_changes(self):
+        old_cache_dir = settings.TEMPLATE_CACHE_DIR
+        settings.TEMPLATE_CACHE_DIR = tempfile.mkdtemp()
+        settings.TEMPLATE_PREPROCESSOR_PERSIST_TEMPLATE_INDEX = True
+        try:
+            index = get_template_index()
+            self.assertTrue(os.path.exists(os.path.join(settings.TEMPLATE_CACHE_DIR, 'template-index.pickle')))
+
+            clear_template_index()
+            directories = utils._get_template_directories()
+            self.assertEqual(get_template_index().templates, index.templates)
+            self.assertTrue(get_template_index().is_up_to_date(directories))
+
+            get_template_index().directory_mtimes[settings.TEMPLATE_DIRS[0]] = 0
+            self.assertFalse(get_template_index().is_up_to_date(directories))
+        finally:
+            shutil.rmtree(settings.TEMPLATE_CACHE_DIR)
+            settings.TEMPLATE_CACHE_DIR = old_cache_dir
+            del settings.TEMPLATE_PREPROCESSOR_PERSIST_TEMPLATE_INDEX
+
+    def test_only_the_cache_dir_is_skipped(self):
+        old_cache_dir = settings.TEMPLATE_CACHE_DIR
+        directory = tempfile.mkdtemp()
+        settings.TEMPLATE_CACHE_DIR = os.path.join(directory, 'cache')
+        try:
+            for d in ('cache', 'cache2'):
+                os.mkdir(os.path.join(directory, d))
+                open(os.path.join(directory, d, 'page.html'), 'w').write('')
+
+            index = utils._TemplateIndex([ (directory, False) ])
+            self.assertTrue(os.path.join('cache2', 'page.html') in index.paths)
+            self.assertFalse(os.path.join('cache', 'page.html') in index.paths)
+        finally:
+            shutil.rmtree(directory)
+            settings.TEMPLATE_CACHE_DIR = old_cache_dir
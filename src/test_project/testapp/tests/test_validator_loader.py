@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+from unittest import TestCase
+
+from django.conf import settings
+from django.template import Template, Context
+
+from template_preprocessor.template import loaders
+from template_preprocessor.template.loaders import ValidatorLoader
+
+
+class TestValidatorLoader(TestCase):
+
+    def setUp(self):
+        self.compiled = []
+        self._real_compile = loaders.compile
+
+        def compile(code, *args, **kwargs):
+            self.compiled.append(kwargs.get('path'))
+            return self._real_compile(code, *args, **kwargs)
+        loaders.compile = compile
+
+        self.loader = ValidatorLoader(settings.TEMPLATE_LOADERS)
+
+    def tearDown(self):
+        loaders.compile = self._real_compile
+
+    def test_validation_is_cached(self):
+        self.loader.load_template('inheritance/level-one.html')
+        self.loader.load_template('inheritance/level-one.html')
+        self.assertEqual(self.compiled, ['inheritance/level-one.html'])
+
+    def test_dependency_change_invalidates_cache(self):
+        self.loader.load_template('inheritance/level-one.html')
+
+        key = self.loader._validated.keys()[0]
+        self.loader._validated[key]['inheritance/base.html'] = 'changed'
+
+        self.loader.load_template('inheritance/level-one.html')
+        self.assertEqual(len(self.compiled), 2)
+
+    def test_no_validation_while_rendering(self):
+        loader = self.loader
+
+        class LoadingTemplate(Template):
+            def _render(self, context):
+                loader.load_template('include/include_template.html')
+                return u''
+
+        LoadingTemplate('').render(Context())
+        self.assertEqual(self.compiled, [])